@@ -0,0 +1,235 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+# 计算数据内容的哈希
+def content_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+# 计算两个数据内容之间按字段的差异
+def diff_payload(old, new, path=None, ops=None):
+    """返回把 old 变成 new 的操作列表
+
+    [路径, 新值] 表示设置字段, [路径] 表示删除字段, 路径是字典键和列表下标组成的列表。
+    长度相同的列表按下标逐项比较, 长度不同时整体替换。
+    """
+    path = path or []
+    ops = [] if ops is None else ops
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key not in old:
+                ops.append([path + [key], value])
+            elif old[key] != value or type(old[key]) is not type(value):
+                diff_payload(old[key], value, path + [key], ops)
+        for key in old:
+            if key not in new:
+                ops.append([path + [key]])
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        for i, (old_item, new_item) in enumerate(zip(old, new)):
+            if old_item != new_item or type(old_item) is not type(new_item):
+                diff_payload(old_item, new_item, path + [i], ops)
+    elif old != new or type(old) is not type(new):
+        ops.append([path, new])
+    return ops
+
+# 把差异应用到数据内容上, 返回新的数据内容
+def apply_delta(base, ops):
+    """只复制被修改路径上的容器, 未修改的部分与 base 共享"""
+    root = {"": base}
+    copied = set()
+
+    def writable(container):
+        if id(container) in copied:
+            return container
+        clone = dict(container) if isinstance(container, dict) else list(container)
+        copied.add(id(clone))
+        return clone
+
+    for op in ops:
+        keys = [""] + op[0]
+        parent = root
+        for key in keys[:-1]:
+            child = writable(parent[key])
+            parent[key] = child
+            parent = child
+        if len(op) == 2:
+            parent[keys[-1]] = op[1]
+        else:
+            del parent[keys[-1]]
+    return root[""]
+
+class BlobStore:
+    """按内容寻址的数据快照表
+
+    每个不同的数据内容只保存一次, 以内容的哈希作为键, 追加写入 JSONL 文件。
+    同一用户同一类型的相邻快照通常只有几个数值不同, 因此新快照以上一个快照为基准只保存字段差异,
+    每隔 keyframe_interval 个快照保存一次完整内容作为关键帧, 读取时最多回溯一个关键帧间隔。
+    内存中只保存哈希到文件偏移的映射以及最近使用内容的缓存,
+    完全相同的快照重复提交时不会产生任何新的写入。
+    不再被引用的快照由 compact() 重写数据文件时删除。
+    """
+
+    def __init__(self, path, cache_size=10000, keyframe_interval=32):
+        self.path = path
+        self.cache_size = cache_size
+        self.keyframe_interval = keyframe_interval
+        self.offsets = {}  # 哈希 -> 文件偏移
+        self.depths = {}  # 哈希 -> 距离最近关键帧的差异层数
+        self.cache = OrderedDict()  # 最近使用的内容
+        self.lock = threading.Lock()
+        self._writer = None
+        self._reader = None
+
+    def open(self):
+        """扫描数据文件, 建立哈希到偏移的映射"""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    try:
+                        blob = json_codec.loads(line)
+                        key = blob["h"]
+                        self.depths[key] = self.depths[blob["b"]] + 1 if "b" in blob else 0
+                        self.offsets[key] = offset
+                    except (json_codec.JSONDecodeError, KeyError):
+                        # 崩溃时最后一行可能只写了一半
+                        logger.warning(f"跳过损坏的数据快照: {self.path}@{offset}")
+                    offset += len(line)
+        self._writer = open(self.path, 'ab')
+        self._reader = open(self.path, 'rb')
+        logger.info(f"已加载数据快照表: {len(self.offsets)} 个不同的快照")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def put(self, payload, base=None):
+        """保存数据内容并返回其哈希, 内容已存在时不写入
+
+        base 为同一用户同一类型的上一个快照, 给出时优先只保存与它的差异。
+        """
+        text = json_codec.dumps(payload, pretty=False, sort_keys=True)
+        key = content_hash(text)
+        with self.lock:
+            if key not in self.offsets:
+                line = '{"h":"' + key + '","d":' + text + '}\n'
+                depth = 0
+                if base in self.offsets and self.depths[base] + 1 < self.keyframe_interval:
+                    ops = diff_payload(self._get(base), payload)
+                    delta_text = json_codec.dumps(ops, pretty=False)
+                    # 差异比完整内容还大时直接保存关键帧
+                    if len(delta_text) < len(text):
+                        line = '{"h":"' + key + '","b":"' + base + '","x":' + delta_text + '}\n'
+                        depth = self.depths[base] + 1
+                offset = self._writer.tell()
+                self._writer.write(line.encode('utf-8'))
+                self._writer.flush()
+                self.offsets[key] = offset
+                self.depths[key] = depth
+            self._remember(key, payload)
+        return key
+
+    def get(self, key):
+        """按哈希读取数据内容"""
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        # 沿差异链回溯到缓存中的内容或关键帧, 再依次应用差异
+        chain = []
+        while key not in self.cache:
+            self._reader.seek(self.offsets[key])
+            blob = json_codec.loads(self._reader.readline())
+            if "d" in blob:
+                self._remember(key, blob["d"])
+                break
+            chain.append((key, blob["x"]))
+            key = blob["b"]
+        payload = self.cache[key]
+        self.cache.move_to_end(key)
+        for delta_key, ops in reversed(chain):
+            payload = apply_delta(payload, ops)
+            self._remember(delta_key, payload)
+        return payload
+
+    def _remember(self, key, payload):
+        self.cache[key] = payload
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def compact(self, live):
+        """重写数据文件, 只保留 live 中的快照以及它们的差异链依赖的基准快照, 返回删除的快照数
+
+        新文件写完并落盘后才替换旧文件, 中途崩溃时旧文件保持不变。保留的快照顺序和差异链都不变,
+        基准快照仍然排在依赖它的快照之前。
+        """
+        with self.lock:
+            bases = {}
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        blob = json_codec.loads(line)
+                    except json_codec.JSONDecodeError:
+                        continue
+                    if "b" in blob:
+                        bases[blob["h"]] = blob["b"]
+            needed = set()
+            pending = [key for key in live if key in self.offsets]
+            while pending:
+                key = pending.pop()
+                if key not in needed:
+                    needed.add(key)
+                    if key in bases:
+                        pending.append(bases[key])
+            removed = len(self.offsets) - len(needed)
+            if removed == 0:
+                return 0
+
+            temp_path = self.path + ".tmp"
+            offsets = {}
+            with open(self.path, 'rb') as source, open(temp_path, 'wb') as target:
+                for line in source:
+                    try:
+                        key = json_codec.loads(line)["h"]
+                    except (json_codec.JSONDecodeError, KeyError):
+                        continue
+                    if key in needed and key not in offsets:
+                        offsets[key] = target.tell()
+                        target.write(line)
+                target.flush()
+                os.fsync(target.fileno())
+            self._writer.close()
+            self._reader.close()
+            os.replace(temp_path, self.path)
+            self._writer = open(self.path, 'ab')
+            self._reader = open(self.path, 'rb')
+            self.offsets = offsets
+            self.depths = {key: depth for key, depth in self.depths.items() if key in offsets}
+            for key in [key for key in self.cache if key not in offsets]:
+                del self.cache[key]
+        logger.info(f"数据快照表压缩完成: 保留 {len(offsets)} 个快照, 删除 {removed} 个不再引用的快照")
+        return removed
+
+    def sync(self):
+        """把已写入的快照落盘, fsync 期间不阻塞其他写入"""
+        with self.lock:
+            fd = os.dup(self._writer.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        with self.lock:
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            if self._reader:
+                self._reader.close()
+                self._reader = None
@@ -0,0 +1,162 @@
+import os
+import time
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import json_codec
+from record_files import RecordFiles
+from consolidated_data_server import (DATA_DIR, build_record, create_store, init_consolidated_data,
+                                      write_file_atomic)
+
+logger = logging.getLogger(__name__)
+
+IMPORT_SOURCE_DIR = "civitas_data"  # simple_data_server.py 的数据目录
+IMPORT_PROGRESS_FILE = os.path.join(DATA_DIR, "bulk_import_progress.json")  # 记录导入进度, 用于中断后继续
+IMPORT_BATCH_SIZE = 1000  # 每个工作进程一次解析、每次写入存储的记录数
+IMPORT_REPORT_INTERVAL = 5  # 输出导入速度的时间间隔(秒)
+
+_worker_records = None  # 工作进程中读取记录文件的 RecordFiles
+
+def server_time_to_iso(timestamp):
+    """把文件名中的 YYYY-MM-DD_HH-MM-SS 转换为 ISO 格式"""
+    return timestamp[:10] + "T" + timestamp[11:].replace('-', ':')
+
+def parse_batch(source, keys):
+    """在工作进程中读取并解析一批记录文件, 返回 (存储记录列表, 跳过的文件数)
+
+    记录的接收时间取文件名中服务器收到记录的时间, 记录内容缺少时间戳时也用它代替。
+    """
+    global _worker_records
+    if _worker_records is None or _worker_records.directory != source:
+        _worker_records = RecordFiles(source)
+    records = []
+    skipped = 0
+    for timestamp, filename, record_type, _ in keys:
+        try:
+            data = _worker_records.read(filename)
+            if not isinstance(data, dict):
+                raise ValueError("Record not found")
+            received = server_time_to_iso(timestamp)
+            records.append(build_record(dict(data, type=record_type, timestamp=data.get('timestamp') or received),
+                                        received))
+        except ValueError as e:
+            logger.warning(f"跳过记录文件 {filename}: {str(e)}")
+            skipped += 1
+    return records, skipped
+
+def load_progress():
+    if not os.path.exists(IMPORT_PROGRESS_FILE):
+        return None
+    with open(IMPORT_PROGRESS_FILE, 'r', encoding='utf-8') as f:
+        return json_codec.load(f)
+
+def save_progress(progress):
+    write_file_atomic(IMPORT_PROGRESS_FILE, json_codec.dumps(progress, pretty=False))
+
+def drop_imported(store, records):
+    """去掉历史记录中已经存在的记录
+
+    进度在每批写入完成后才保存, 中断在两者之间时继续导入会重新写入最后一批, 只需对继续后的第一批去重。
+    """
+    kept = []
+    for record in records:
+        _, entries = store.query_history(username=record["username"], record_type=record["type"],
+                                         since=record["timestamp"], until=record["timestamp"])
+        if not any(entry["timestamp"] == record["timestamp"] for entry in entries):
+            kept.append(record)
+    return kept
+
+def bulk_import(source=IMPORT_SOURCE_DIR, storage="wal", workers=None, batch_size=IMPORT_BATCH_SIZE, restart=False):
+    """把每条记录一个文件的数据目录导入整合数据存储, 返回导入的记录数
+
+    记录按服务器收到的时间顺序读取, 由进程池并行读取和解析, 主进程按原来的顺序逐批写入存储,
+    与服务器当时按到达顺序更新最新数据的结果一致。同时在解析中的批数有上限, 内存中只保留记录的文件名等元数据,
+    记录内容的内存占用与记录总数无关。
+    每批写入后保存进度, 中断后重新运行会从上次的位置继续。需在整合数据服务器停止时运行。
+    导入的记录按到达顺序覆盖最新数据, 会用较早的数据覆盖存储中已有的较新数据, 因此开始新的导入时存储必须为空,
+    存储中已有数据时抛出 ValueError。
+    """
+    progress = None if restart else load_progress()
+    if progress is not None and progress["source"] != os.path.abspath(source):
+        raise ValueError(f"进度文件 {IMPORT_PROGRESS_FILE} 属于另一个数据目录: {progress['source']}")
+    records = RecordFiles(source)
+    keys = records.keys_after(progress["last"] if progress else None)
+    records.close()
+    resuming = progress is not None
+    if not resuming:
+        progress = {"source": os.path.abspath(source), "last": None, "imported": 0, "skipped": 0}
+    else:
+        logger.info(f"从上次的进度继续导入: 已导入 {progress['imported']} 条记录")
+    logger.info(f"共有 {len(keys)} 条记录等待导入")
+
+    init_consolidated_data()
+    # 导入的历史记录可能早于保留期限, 导入时不删除任何历史记录分段
+    store = create_store(storage, history_retention_days=0)
+    store.open()
+    stats = store.stats()
+    if not resuming and (stats["total_users"] or stats["history_records"]):
+        store.close()
+        raise ValueError(f"整合数据存储中已有数据 ({stats['total_users']} 个用户, {stats['history_records']} 条历史记录), "
+                         f"导入会用较早的记录覆盖较新的最新数据, 请先清空 {DATA_DIR} 中的整合数据或改用新的数据目录")
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    reported = started
+    imported = 0
+    first_batch = True
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            batches = (keys[i:i + batch_size] for i in range(0, len(keys), batch_size))
+            for batch in batches:
+                pending.append((batch[-1], executor.submit(parse_batch, source, batch)))
+                # 最多同时解析 workers * 2 批, 按提交顺序写入
+                while len(pending) >= workers * 2:
+                    imported += _apply_next(store, pending, progress, first_batch)
+                    first_batch = False
+                    reported = _report(started, reported, imported)
+            while pending:
+                imported += _apply_next(store, pending, progress, first_batch)
+                first_batch = False
+                reported = _report(started, reported, imported)
+    finally:
+        store.close()
+    elapsed = time.perf_counter() - started
+    logger.info(f"导入完成: 本次导入 {imported} 条记录, 用时 {elapsed:.1f} 秒 "
+                f"({imported / elapsed if elapsed else 0:.0f} 条/秒), 累计导入 {progress['imported']} 条, "
+                f"跳过 {progress['skipped']} 个无法解析的文件")
+    return imported
+
+def _apply_next(store, pending, progress, first_batch):
+    last, future = pending.popleft()
+    records, skipped = future.result()
+    # 继续导入时去掉上次中断前已经写入的记录, 累计导入数只增加实际写入的记录数
+    batch = drop_imported(store, records) if first_batch and progress["imported"] else records
+    if batch:
+        store.record_batch(batch)
+    progress["last"] = list(last)
+    progress["imported"] += len(batch)
+    progress["skipped"] += skipped
+    save_progress(progress)
+    return len(batch)
+
+def _report(started, reported, imported):
+    now = time.perf_counter()
+    if now - reported < IMPORT_REPORT_INTERVAL:
+        return reported
+    logger.info(f"已导入 {imported} 条记录, {imported / (now - started):.0f} 条/秒")
+    return now
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="把 simple_data_server.py 的记录文件导入整合数据服务器的存储")
+    parser.add_argument('--source', default=IMPORT_SOURCE_DIR, help=f"记录文件所在的数据目录, 默认 {IMPORT_SOURCE_DIR}")
+    parser.add_argument('--storage', choices=("wal", "sqlite"), default="wal",
+                        help="写入的存储模式, wal 导入完成时写出检查点, 之后可以用 snapshot 或 wal 模式启动服务器")
+    parser.add_argument('--workers', type=int, default=None, help="解析记录文件的进程数, 默认 CPU 核数")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                        help=f"每批解析和写入的记录数, 默认 {IMPORT_BATCH_SIZE}")
+    parser.add_argument('--restart', action='store_true', help="忽略上次的进度, 从头开始导入, 需先清空已经导入的数据")
+    args = parser.parse_args()
+    bulk_import(source=args.source, storage=args.storage, workers=args.workers, batch_size=args.batch_size,
+                restart=args.restart)
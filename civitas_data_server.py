@@ -1,9 +1,12 @@
 import os
-import json
-import datetime
-from flask import Flask, request, jsonify
+import time
+import json_codec
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from markupsafe import escape  # Using markupsafe instead of jinja2 for escape
+from metrics import Registry, HttpMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from record_files import RecordFiles, RECORD_TYPES
+from request_body import RequestBodyError, decode_request_body
 
 app = Flask(__name__)
 CORS(app)  # 启用CORS，允许油猴脚本跨域请求
@@ -13,31 +16,64 @@ DATA_DIR = "civitas_data"
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
+LIST_RECORDS_DEFAULT_LIMIT = 100  # /api/list_records 默认返回的记录条数
+LIST_RECORDS_MAX_LIMIT = 10000  # /api/list_records 单次最多返回的记录条数
+
+# 数据目录及其内存索引, 第一次使用时读取索引文件建立
+RECORDS = RecordFiles(DATA_DIR)
+
+# /metrics 输出的指标, 路由标签直接使用 Flask 的路由规则
+METRICS = Registry()
+HTTP_METRICS = HttpMetrics(METRICS)
+METRICS.gauge("civitas_store_users", "每种类型有最新数据的用户数",
+              lambda: {(record_type,): users for record_type, (users, _) in RECORDS.type_counts().items()}, ("type",))
+METRICS.gauge("civitas_history_records", "每种类型的历史记录文件数",
+              lambda: {(record_type,): records for record_type, (_, records) in RECORDS.type_counts().items()}, ("type",))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "other"
+    HTTP_METRICS.observe(request.method, route, response.status_code, time.perf_counter() - g.request_started,
+                         request.content_length or 0, response.calculate_content_length() or 0)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 格式的指标"""
+    return Response(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
+
+def request_json():
+    """解析请求体中的 JSON, 支持 gzip 压缩的请求体, 无法解析时抛出 RequestBodyError"""
+    body = decode_request_body(request.get_data(), request.headers.get('Content-Encoding'))
+    try:
+        return json_codec.loads(body)
+    except json_codec.JSONDecodeError:
+        raise RequestBodyError(400, "Invalid JSON")
+
+@app.errorhandler(RequestBodyError)
+def request_body_error(e):
+    return jsonify({"status": 0, "message": e.message}), e.status_code
+
 @app.route('/api/record_status', methods=['POST'])
 def record_status():
     """记录状态数据"""
     try:
-        data = request.json
+        data = request_json()
         if not data:
             return jsonify({"status": 0, "message": "No data provided"}), 400
         
-        # 确保有基本信息
-        username = data.get('username', 'unknown')
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        
-        # 记录状态信息
-        status_file = os.path.join(DATA_DIR, f"status_{username}_{timestamp}.json")
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        # 更新最新状态文件
-        latest_status_file = os.path.join(DATA_DIR, f"status_{username}_latest.json")
-        with open(latest_status_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # 记录状态信息并更新最新状态文件
+        status_file = RECORDS.write("status", data)
         
         print(f"状态数据已记录: {status_file}")
         return jsonify({"status": 1, "message": "Status data recorded successfully"})
     
+    except RequestBodyError:
+        raise
     except Exception as e:
         print(f"记录状态数据时出错: {str(e)}")
         return jsonify({"status": 0, "message": f"Error recording status data: {str(e)}"}), 500
@@ -46,50 +82,67 @@ def record_status():
 def record_skill():
     """记录技能数据"""
     try:
-        data = request.json
+        data = request_json()
         if not data:
             return jsonify({"status": 0, "message": "No data provided"}), 400
         
-        # 确保有基本信息
-        username = data.get('username', 'unknown')
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        
-        # 记录技能信息
-        skill_file = os.path.join(DATA_DIR, f"skill_{username}_{timestamp}.json")
-        with open(skill_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        # 更新最新技能文件
-        latest_skill_file = os.path.join(DATA_DIR, f"skill_{username}_latest.json")
-        with open(latest_skill_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # 记录技能信息并更新最新技能文件
+        skill_file = RECORDS.write("skill", data)
         
         print(f"技能数据已记录: {skill_file}")
         return jsonify({"status": 1, "message": "Skill data recorded successfully"})
     
+    except RequestBodyError:
+        raise
     except Exception as e:
         print(f"记录技能数据时出错: {str(e)}")
         return jsonify({"status": 0, "message": f"Error recording skill data: {str(e)}"}), 500
 
+@app.route('/api/record_batch', methods=['POST'])
+def record_batch():
+    """批量记录油猴脚本一次提交的多条数据, 请求体可以是 gzip 压缩的"""
+    try:
+        data = request_json()
+        items = data.get("records") if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({"status": 0, "message": "No records provided"}), 400
+        
+        results = RECORDS.write_batch(items)
+        recorded = sum(1 for result in results if result["status"] == 1)
+        print(f"批量数据已记录: {recorded}/{len(results)}")
+        return jsonify({
+            "status": 1 if recorded == len(results) else 0,
+            "message": f"{recorded}/{len(results)} records recorded",
+            "results": results
+        })
+    
+    except RequestBodyError:
+        raise
+    except Exception as e:
+        print(f"批量记录数据时出错: {str(e)}")
+        return jsonify({"status": 0, "message": f"Error recording batch: {str(e)}"}), 500
+
 @app.route('/api/list_records', methods=['GET'])
 def list_records():
-    """列出所有记录"""
+    """分页列出记录, 支持 type= 和 username= 筛选, 默认最新的在前, order=asc 时最早的在前"""
     try:
-        records = []
-        for filename in os.listdir(DATA_DIR):
-            if filename.endswith(".json") and not filename.endswith("_latest.json"):
-                file_path = os.path.join(DATA_DIR, filename)
-                stat = os.stat(file_path)
-                records.append({
-                    "filename": filename,
-                    "size": stat.st_size,
-                    "created": datetime.datetime.fromtimestamp(stat.st_ctime).strftime("%Y-%m-%d %H:%M:%S")
-                })
+        record_type = request.args.get('type')
+        username = request.args.get('username')
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = int(request.args.get('limit', LIST_RECORDS_DEFAULT_LIMIT))
+        except ValueError:
+            offset = limit = -1
+        if offset < 0 or limit < 0:
+            return jsonify({"status": 0, "message": "Invalid offset or limit"}), 400
+        if record_type is not None and record_type not in RECORD_TYPES:
+            return jsonify({"status": 0, "message": f"Unknown record type: {record_type}"}), 400
         
-        # 按时间排序，最新的在前
-        records.sort(key=lambda x: x["created"], reverse=True)
+        total, records = RECORDS.list(record_type=record_type, username=username, offset=offset,
+                                      limit=min(limit, LIST_RECORDS_MAX_LIMIT),
+                                      newest_first=request.args.get('order', 'desc') != 'asc')
         
-        return jsonify({"status": 1, "data": records})
+        return jsonify({"status": 1, "total": total, "offset": offset, "data": records})
     
     except Exception as e:
         print(f"列出记录时出错: {str(e)}")
@@ -99,13 +152,10 @@ def list_records():
 def get_record(filename):
     """获取特定记录的内容"""
     try:
-        file_path = os.path.join(DATA_DIR, filename)
-        if not os.path.exists(file_path):
+        data = RECORDS.read(filename)
+        if data is None:
             return jsonify({"status": 0, "message": "Record not found"}), 404
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
         return jsonify({"status": 1, "data": data})
     
     except Exception as e:
@@ -116,34 +166,7 @@ def get_record(filename):
 def get_stats():
     """获取统计信息"""
     try:
-        # 找出所有用户
-        users = set()
-        status_records = 0
-        skill_records = 0
-        
-        for filename in os.listdir(DATA_DIR):
-            if not filename.endswith("_latest.json"):
-                parts = filename.split('_')
-                if len(parts) >= 2:
-                    record_type = parts[0]
-                    username = parts[1]
-                    users.add(username)
-                    
-                    if record_type == "status":
-                        status_records += 1
-                    elif record_type == "skill":
-                        skill_records += 1
-        
-        return jsonify({
-            "status": 1, 
-            "data": {
-                "total_users": len(users),
-                "users": list(users),
-                "status_records": status_records,
-                "skill_records": skill_records,
-                "total_records": status_records + skill_records
-            }
-        })
+        return jsonify({"status": 1, "data": RECORDS.stats()})
     
     except Exception as e:
         print(f"获取统计信息时出错: {str(e)}")
@@ -181,8 +204,13 @@ def home():
             </div>
             
             <div class="endpoint">
-                <p><span class="method">GET</span> /api/list_records</p>
-                <p>列出所有记录的数据文件</p>
+                <p><span class="method">POST</span> /api/record_batch</p>
+                <p>批量记录多条数据, 支持 gzip 压缩的请求体</p>
+            </div>
+            
+            <div class="endpoint">
+                <p><span class="method">GET</span> /api/list_records?type=&amp;username=&amp;offset=&amp;limit=&amp;order=</p>
+                <p>分页列出记录的数据文件, 可按类型和用户筛选</p>
             </div>
             
             <div class="endpoint">
@@ -201,4 +229,5 @@ def home():
 if __name__ == '__main__':
     print(f"Civitas 数据服务器启动中...")
     print(f"数据将被保存到 {os.path.abspath(DATA_DIR)} 目录")
+    RECORDS.load()
     app.run(host='0.0.0.0', port=5000, debug=True)
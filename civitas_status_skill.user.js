@@ -38,17 +38,22 @@
             // 获取技能信息
             const skillData = await getSkill();
             
-            // 将数据发送到后端服务器
+            // 将数据合并为一次批量请求发送到后端服务器
+            const records = [];
             if (userDetailData) {
-                sendDataToServer('userdetail', userDetailData);
+                records.push({ type: 'userdetail', ...userDetailData });
             }
             
             if (statusData) {
-                sendDataToServer('status', statusData);
+                records.push({ type: 'status', ...statusData });
             }
             
             if (skillData) {
-                sendDataToServer('skill', skillData);
+                records.push({ type: 'skill', ...skillData });
+            }
+            
+            if (records.length > 0) {
+                await sendRecordsToServer(records);
             }
             
             console.log("Civitas Status and Skill Monitor 数据获取完成!");
@@ -253,53 +258,62 @@
         }
     }
     
-    // 发送数据到后端服务器
-    function sendDataToServer(type, data) {
-        let url;
-        let typeName;
-        
-        switch(type) {
-            case 'status':
-                url = `${SERVER_URL}/api/record_status`;
-                typeName = '状态';
-                break;
-            case 'skill':
-                url = `${SERVER_URL}/api/record_skill`;
-                typeName = '技能';
-                break;
-            case 'userdetail':
-                url = `${SERVER_URL}/api/record_userdetail`;
-                typeName = '用户详细信息';
-                break;
-            default:
-                console.error('未知的数据类型');
-                return;
+    // 数据类型对应的中文名称
+    const TYPE_NAMES = {
+        status: '状态',
+        skill: '技能',
+        userdetail: '用户详细信息'
+    };
+    
+    // 浏览器支持时使用 gzip 压缩请求体, 用户详细信息等数据压缩后只有原来的几分之一
+    async function compressBody(text) {
+        if (typeof CompressionStream === 'undefined') {
+            return { body: text, headers: {} };
         }
+        const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+        const body = await new Response(stream).blob();
+        return { body: body, headers: { 'Content-Encoding': 'gzip' } };
+    }
+    
+    // 批量发送数据到后端服务器
+    async function sendRecordsToServer(records) {
+        const url = `${SERVER_URL}/api/record_batch`;
+        const typeNames = records.map(record => TYPE_NAMES[record.type]).join('、');
+        
+        console.log(`正在发送${typeNames}数据到服务器...`);
         
-        console.log(`正在发送${typeName}数据到服务器...`);
+        const compressed = await compressBody(JSON.stringify({ records: records }));
         
         // 使用GM_xmlhttpRequest进行跨域请求
         GM_xmlhttpRequest({
             method: 'POST',
             url: url,
-            data: JSON.stringify(data),
+            data: compressed.body,
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                ...compressed.headers
             },
             onload: function(response) {
                 try {
                     const result = JSON.parse(response.responseText);
-                    if (result.status === 1) {
-                        console.log(`${typeName}数据已成功发送到服务器`);
-                    } else {
-                        console.error(`发送${typeName}数据失败:`, result.message);
+                    if (!result.results) {
+                        console.error(`发送${typeNames}数据失败:`, result.message);
+                        return;
                     }
+                    result.results.forEach((item, index) => {
+                        const typeName = TYPE_NAMES[records[index].type];
+                        if (item.status === 1) {
+                            console.log(`${typeName}数据已成功发送到服务器`);
+                        } else {
+                            console.error(`发送${typeName}数据失败:`, item.message);
+                        }
+                    });
                 } catch (e) {
                     console.error(`解析服务器响应时出错:`, e);
                 }
             },
             onerror: function(error) {
-                console.error(`发送${typeName}数据时出错:`, error);
+                console.error(`发送${typeNames}数据时出错:`, error);
             }
         });
     }
@@ -0,0 +1,78 @@
+import json
+import time
+import random
+import argparse
+
+import json_codec
+
+def sample_userdetail(i):
+    """生成一条与 /get_userdetail/ 返回结构相同的用户详细信息, 用于基准测试"""
+    places = ["长安", "洛阳", "建康", "成都", "江陵", "襄阳", "广陵", "会稽"]
+    rng = random.Random(i)
+    return {
+        "type": "userdetail",
+        "username": f"user{i:04d}",
+        "timestamp": f"2025-03-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00.000Z",
+        "data": {
+            "uid": 100000 + i,
+            "username": f"user{i:04d}",
+            "avatar": f"https://api.civitas2.top/media/avatar/{i % 50}.png",
+            "level": rng.randint(1, 60),
+            "now_exp": rng.randint(0, 100000),
+            "need_exp": rng.randint(100000, 200000),
+            "work_at": [rng.randint(1, 500), f"{rng.choice(places)}工坊"],
+            "location": [rng.randint(1, 30), f"{rng.choice(places)}州"],
+            "location_county": [rng.randint(1, 300), f"{rng.choice(places)}县"],
+            "native_place": [rng.randint(1, 300), f"{rng.choice(places)}郡"],
+            "stay_at": [rng.randint(1, 5000), f"{rng.choice(places)}客栈"],
+            "depository": [rng.randint(1, 5000), f"{rng.choice(places)}仓库"],
+            "money": round(rng.uniform(0, 100000), 2),
+            "title": ["布衣", "里正", "县丞", "太守"][rng.randint(0, 3)],
+            "items": [{"id": rng.randint(1, 400), "name": f"物品{rng.randint(1, 400)}", "count": rng.randint(1, 99)}
+                      for _ in range(20)],
+        },
+    }
+
+def _best(func, repeat):
+    """多次运行取最短耗时(秒)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmark(users=1000, repeat=5):
+    """比较旧的缩进格式、标准库紧凑格式和 orjson 在用户详细信息数据上的编解码耗时和大小"""
+    payload = {"userdetail": {f"user{i:04d}": sample_userdetail(i) for i in range(users)}}
+    codecs = [
+        ("json indent=2", lambda obj: json.dumps(obj, ensure_ascii=False, indent=2), json.loads),
+        ("json compact", lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')), json.loads),
+    ]
+    if json_codec.orjson is not None:
+        codecs.append(("orjson compact", json_codec.orjson.dumps, json_codec.orjson.loads))
+    results = []
+    for name, encode, decode in codecs:
+        text = encode(payload)
+        size = len(text.encode('utf-8') if isinstance(text, str) else text)
+        encode_time = _best(lambda: encode(payload), repeat)
+        decode_time = _best(lambda: decode(text), repeat)
+        results.append((name, size, encode_time, decode_time))
+
+    base_size, base_encode, base_decode = results[0][1:]
+    print(f"用户详细信息基准测试: {users} 个用户, 每项取 {repeat} 次中的最短耗时")
+    print(f"{'格式':<16}{'大小(KB)':>12}{'编码(ms)':>12}{'解码(ms)':>12}{'大小':>8}{'编码':>8}{'解码':>8}")
+    for name, size, encode_time, decode_time in results:
+        print(f"{name:<16}{size / 1024:>12.1f}{encode_time * 1000:>12.2f}{decode_time * 1000:>12.2f}"
+              f"{size / base_size:>8.2f}{base_encode / encode_time:>7.1f}x{base_decode / decode_time:>7.1f}x")
+    if json_codec.orjson is None:
+        print("未安装 orjson, 安装后(pip install orjson)可以获得更快的编解码速度")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="JSON 编解码基准测试")
+    parser.add_argument('--users', type=int, default=1000, help="生成的用户数, 默认 1000")
+    parser.add_argument('--repeat', type=int, default=5, help="每项测试的重复次数, 默认 5")
+    args = parser.parse_args()
+    benchmark(users=args.users, repeat=args.repeat)
@@ -0,0 +1,147 @@
+import os
+import sys
+import math
+import logging
+import threading
+from array import array
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+# 导出的数值字段
+STATUS_FIELDS = ("stamina", "health", "happiness", "starvation")
+SKILL_FIELDS = ("skill_num", "comprehension", "eureka_chance")
+
+_BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+# array 类型码对应的 .npy 数据类型
+NPY_DTYPES = {
+    'i': _BYTE_ORDER + 'i4',
+    'd': _BYTE_ORDER + 'f8',
+}
+
+_export_lock = threading.Lock()
+
+def write_npy(path, values):
+    """把 array 写成 .npy 文件(格式版本 1.0), 不依赖 numpy"""
+    descr = NPY_DTYPES[values.typecode]
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({len(values)},), }}"
+    # 魔数、版本号和头部长度共 10 字节, 头部以换行结尾并补齐到 64 字节对齐
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    with open(path, 'wb') as f:
+        f.write(b'\x93NUMPY\x01\x00')
+        f.write(len(header).to_bytes(2, 'little'))
+        f.write(header)
+        values.tofile(f)
+
+def _number(value):
+    """把字段值转换为浮点数, 缺失或无法转换时为 NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+class Dictionary:
+    """字符串到整数编码的字典, 导出时按字符串排序重新编码"""
+
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def sorted_values(self, column):
+        """返回排序后的字符串列表, 并把 column 中的编码改为排序后的下标"""
+        values = sorted(self.codes)
+        remap = array('i', [0]) * len(values)
+        for new_code, value in enumerate(values):
+            remap[self.codes[value]] = new_code
+        for i, code in enumerate(column):
+            column[i] = remap[code]
+        return values
+
+class Table:
+    """一张按列保存的表, user 和 timestamp 列保存字典编码"""
+
+    def __init__(self, fields, extra_codes=()):
+        self.columns = {"user": array('i'), "timestamp": array('i')}
+        for name in extra_codes:
+            self.columns[name] = array('i')
+        for field in fields:
+            self.columns[field] = array('d')
+
+    def __len__(self):
+        return len(self.columns["user"])
+
+def export_columnar(entries, output_dir):
+    """把历史记录中的状态和技能数据导出为按列保存的 .npy 文件
+
+    状态数据写入 output_dir/status, 每行是一次提交中今日的各项状态;
+    技能数据写入 output_dir/skill, 每行是一次提交中的一个技能。
+    user、timestamp、skill 列是对应字典 users.json、timestamps.json、skills.json 中的下标,
+    字典按字符串排序, 因此 timestamp 列的大小顺序就是时间顺序。
+    返回描述导出结果的清单, 同时写入 output_dir/manifest.json。
+    """
+    with _export_lock:
+        users = Dictionary()
+        timestamps = Dictionary()
+        skills = Dictionary()
+        status = Table(STATUS_FIELDS)
+        skill = Table(SKILL_FIELDS, extra_codes=("skill",))
+
+        for entry in entries:
+            data = entry.get("data")
+            if not isinstance(data, dict):
+                continue
+            if entry["type"] == "status":
+                today = data.get("today")
+                if not isinstance(today, dict):
+                    continue
+                status.columns["user"].append(users.encode(entry["username"]))
+                status.columns["timestamp"].append(timestamps.encode(str(entry["timestamp"])))
+                for field in STATUS_FIELDS:
+                    status.columns[field].append(_number(today.get(field)))
+            elif entry["type"] == "skill":
+                for item in data.get("datalist") or []:
+                    if not isinstance(item, dict):
+                        continue
+                    skill.columns["user"].append(users.encode(entry["username"]))
+                    skill.columns["timestamp"].append(timestamps.encode(str(entry["timestamp"])))
+                    skill.columns["skill"].append(skills.encode(str(item.get("name", item.get("id")))))
+                    for field in SKILL_FIELDS:
+                        skill.columns[field].append(_number(item.get(field)))
+
+        # 字典排序后重新编码, 同一个字典的所有编码列都要一起改写
+        user_column = status.columns["user"] + skill.columns["user"]
+        user_values = users.sorted_values(user_column)
+        status.columns["user"] = user_column[:len(status)]
+        skill.columns["user"] = user_column[len(status):]
+        timestamp_column = status.columns["timestamp"] + skill.columns["timestamp"]
+        timestamp_values = timestamps.sorted_values(timestamp_column)
+        status.columns["timestamp"] = timestamp_column[:len(status)]
+        skill.columns["timestamp"] = timestamp_column[len(status):]
+        skill_values = skills.sorted_values(skill.columns["skill"])
+
+        manifest = {"tables": {}, "dictionaries": {}}
+        for name, table in (("status", status), ("skill", skill)):
+            table_dir = os.path.join(output_dir, name)
+            os.makedirs(table_dir, exist_ok=True)
+            for column, values in table.columns.items():
+                write_npy(os.path.join(table_dir, f"{column}.npy"), values)
+            manifest["tables"][name] = {
+                "rows": len(table),
+                "columns": {column: NPY_DTYPES[values.typecode] for column, values in table.columns.items()}
+            }
+        for name, values in (("users", user_values), ("timestamps", timestamp_values), ("skills", skill_values)):
+            with open(os.path.join(output_dir, f"{name}.json"), 'w', encoding='utf-8') as f:
+                json_codec.dump(values, f)
+            manifest["dictionaries"][name] = len(values)
+        with open(os.path.join(output_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+            json_codec.dump(manifest, f)
+
+        logger.info(f"已导出列式数据到 {output_dir}: 状态 {len(status)} 行, 技能 {len(skill)} 行")
+        return manifest
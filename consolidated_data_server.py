@@ -1,9 +1,28 @@
 import http.server
-import json
+import json_codec
 import os
 import datetime
 import logging
-import shutil
+import glob
+import threading
+import time
+import argparse
+import signal
+import base64
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from history_store import HistorySegments
+from group_commit import GroupCommit
+from blob_store import BlobStore
+from static_assets import StaticAssetCache
+from sqlite_store import SqliteStore
+from columnar_export import export_columnar
+from events import EventBroker, describe_changes
+from ingest_stats import IngestStats
+from metrics import Registry, HttpMetrics, InstrumentedHandlerMixin, directory_size, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from request_log import AccessLog, QueueLogging, parse_sample_rate
+from request_body import RequestBodyError, decode_request_body
+from email.utils import parsedate_to_datetime
 from urllib.parse import urlparse, parse_qs
 
 # 配置日志
@@ -20,7 +39,77 @@ if not os.path.exists(DATA_DIR):
     logger.info(f"创建数据目录: {DATA_DIR}")
 
 CONSOLIDATED_DATA_FILE = os.path.join(DATA_DIR, "consolidated_data.json")
+SQLITE_FILE = os.path.join(DATA_DIR, "consolidated_data.db")
+COLUMNAR_EXPORT_DIR = os.path.join(DATA_DIR, "columnar")  # /api/export_columnar 的导出目录
+# 追加写日志文件前缀, 实际文件名为 consolidated_data.wal.000001 这样的编号分段
+WAL_FILE_PREFIX = os.path.join(DATA_DIR, "consolidated_data.wal")
+WAL_COMPACT_THRESHOLD = 1000  # 日志中累计的记录数超过该值时触发后台压缩
+WAL_COMPACT_INTERVAL = 60  # 后台压缩线程的检查间隔(秒)
+GROUP_COMMIT_WINDOW = 0.002  # wal 模式下等待并发写入合并为一次 fsync 的时间窗口(秒)
+SNAPSHOT_INTERVAL = 5  # 内存状态写回磁盘的时间间隔(秒)
+SNAPSHOT_DIRTY_THRESHOLD = 100  # 脏记录数超过该值时立即写回磁盘
+SERVER_POOL_SIZE = 32  # pool 引擎的工作线程数
+KEEP_ALIVE_TIMEOUT = 15  # 空闲长连接的超时时间(秒)
+SERVER_LISTEN_BACKLOG = 128  # 多线程引擎的监听队列长度
+
+# 记录类型对应的中文名称, 用于日志输出
+RECORD_TYPE_NAMES = {
+    "status": "状态",
+    "skill": "技能",
+    "userdetail": "用户详细信息",
+}
+
+# 整合数据中按用户保存最新数据的字段
+RECORD_SECTIONS = ("status", "skills", "userdetail")
+
+# 记录类型对应的接口响应描述
+RECORD_TYPE_LABELS = {
+    "status": "Status data",
+    "skill": "Skill data",
+    "userdetail": "User detail",
+}
+# 按内容寻址的数据快照文件, 整合数据和历史记录只保存其中的引用
+BLOB_FILE = os.path.join(DATA_DIR, "blobs.jsonl")
+BLOB_KEYFRAME_INTERVAL = 32  # 每隔多少个差异快照保存一次完整的关键帧
+# 按天分段的历史记录目录
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+HISTORY_RETENTION_DAYS = 0  # 历史记录保留天数, 0 表示永久保留, 需要时由 --history-retention-days 开启
+HISTORY_RECENT_LIMIT = 1000  # /api/data 默认返回的最近历史记录条数
+DATA_FIELDS = ("status", "skills", "userdetail", "last_updated", "history")  # /api/data 可以选择返回的字段
+HISTORY_QUERY_DEFAULT_LIMIT = 100  # /api/history 默认返回的记录条数
+HISTORY_QUERY_MAX_LIMIT = 10000  # /api/history 单次最多返回的记录条数
 VISUALIZATION_DIR = "visualization"  # 修改可视化目录为项目根目录下的visualization文件夹
+GZIP_MIN_SIZE = 1024  # 响应体小于该字节数时不压缩
+GZIP_LEVEL = 6  # 动态响应的压缩级别, 静态文件只压缩一次因此使用最高级别
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+EVENTS_HEARTBEAT_INTERVAL = 10  # 事件流没有事件时发送心跳的间隔(秒), 需小于长连接超时
+SENDFILE_MIN_SIZE = 256 * 1024  # 超过该字节数的静态文件不缓存内容, 使用 sendfile 发送
+# /metrics 中按路由统计的路径, 以 / 结尾的按前缀匹配, 其余路径归为 other
+METRIC_ROUTES = ('/', '/visualization', '/visualization/', '/api/data', '/api/get_record/', '/api/stats',
+                 '/api/user_detail', '/api/history', '/api/export_columnar', '/api/events', '/metrics',
+                 '/api/record_status', '/api/record_skill', '/api/record_userdetail', '/api/record_batch')
+
+# 访问日志中成功请求的采样比例, 未列出的路由全部记录; 出错的请求总是记录
+ACCESS_LOG_SAMPLE_RATES = {
+    '/api/record_batch': 0.1,
+    '/api/record_status': 0.1,
+    '/api/record_skill': 0.1,
+    '/api/record_userdetail': 0.1,
+    '/visualization/': 0.1,
+}
+
+# /metrics 输出的指标
+METRICS = Registry()
+LOAD_DURATION = METRICS.histogram("civitas_load_consolidated_data_seconds", "加载整合数据文件的耗时")
+SAVE_DURATION = METRICS.histogram("civitas_save_consolidated_data_seconds", "序列化并写出整合数据文件的耗时")
+
+# 可视化页面的源文件直接从项目根目录提供, 修改后无需重启或复制
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+VISUALIZATION_SOURCES = {
+    "index.html": os.path.join(_script_dir, "visualization.html"),
+    "visualization.js": os.path.join(_script_dir, "visualization.js"),
+    "visualization.css": os.path.join(_script_dir, "visualization.css"),
+}
 
 if not os.path.exists(VISUALIZATION_DIR):
     os.makedirs(VISUALIZATION_DIR)
@@ -30,91 +119,589 @@ if not os.path.exists(VISUALIZATION_DIR):
 def init_consolidated_data():
     if not os.path.exists(CONSOLIDATED_DATA_FILE):
         with open(CONSOLIDATED_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump({
+            json_codec.dump({
                 "status": {},
                 "skills": {},
                 "userdetail": {},
-                "history": [],
                 "last_updated": datetime.datetime.now().isoformat()
-            }, f, ensure_ascii=False, indent=2)
+            }, f)
         logger.info(f"创建整合数据文件: {CONSOLIDATED_DATA_FILE}")
-    
-    # 将可视化文件复制到visualization目录
-    try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # 复制HTML文件
-        html_src = os.path.join(script_dir, "visualization.html")
-        html_dest = os.path.join(VISUALIZATION_DIR, "index.html")
-        if os.path.exists(html_src):
-            shutil.copyfile(html_src, html_dest)
-            logger.info(f"已复制HTML文件: {html_src} -> {html_dest}")
-        else:
-            logger.error(f"HTML文件不存在: {html_src}")
-            
-        # 复制JavaScript文件
-        js_src = os.path.join(script_dir, "visualization.js")
-        js_dest = os.path.join(VISUALIZATION_DIR, "visualization.js")
-        if os.path.exists(js_src):
-            shutil.copyfile(js_src, js_dest)
-            logger.info(f"已复制JS文件: {js_src} -> {js_dest}")
-        else:
-            logger.error(f"JS文件不存在: {js_src}")
-            
-        # 复制CSS文件
-        css_src = os.path.join(script_dir, "visualization.css")
-        css_dest = os.path.join(VISUALIZATION_DIR, "visualization.css")
-        if os.path.exists(css_src):
-            shutil.copyfile(css_src, css_dest)
-            logger.info(f"已复制CSS文件: {css_src} -> {css_dest}")
-        else:
-            logger.error(f"CSS文件不存在: {css_src}")
-        
-        logger.info("可视化文件已复制到visualization目录")
-    except Exception as e:
-        logger.error(f"复制可视化文件时出错: {str(e)}")
 
 # 加载整合数据
 def load_consolidated_data():
-    if os.path.exists(CONSOLIDATED_DATA_FILE):
-        try:
-            with open(CONSOLIDATED_DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 确保userdetail字段存在
-                if "userdetail" not in data:
-                    data["userdetail"] = {}
-                return data
-        except Exception as e:
-            logger.error(f"加载整合数据文件时出错: {str(e)}")
+    with LOAD_DURATION.time():
+        if os.path.exists(CONSOLIDATED_DATA_FILE):
+            try:
+                with open(CONSOLIDATED_DATA_FILE, 'r', encoding='utf-8') as f:
+                    data = json_codec.load(f)
+                    # 确保userdetail字段存在
+                    if "userdetail" not in data:
+                        data["userdetail"] = {}
+                    return data
+            except Exception as e:
+                # 文件损坏时不能退回空数据继续运行, 否则下一次写回会覆盖掉原有的数据
+                logger.error(f"加载整合数据文件时出错: {str(e)}")
+                raise
+        else:
             return {
                 "status": {},
                 "skills": {},
                 "userdetail": {},
-                "history": [],
                 "last_updated": datetime.datetime.now().isoformat()
             }
+
+# 序列化整合数据
+def dump_consolidated_data(data):
+    return json_codec.dumps(data)
+
+# 原子地写入文件: 先写临时文件并落盘, 再重命名覆盖目标文件, 崩溃时只会留下旧文件或新文件
+def write_file_atomic(path, text):
+    temp_file = path + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+    fsync_directory(os.path.dirname(path) or '.')
+
+# 把目录项的修改(重命名)落盘, 不支持打开目录的平台上跳过
+def fsync_directory(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# 把客户端提交的数据转换成存储记录, 数据不合法时抛出 ValueError
+def build_record(body, received=None):
+    if not isinstance(body, dict) or not body:
+        raise ValueError("No data provided")
+    record_type = body.get("type")
+    if record_type not in RECORD_TYPE_NAMES:
+        raise ValueError(f"Unknown record type: {record_type}")
+    
+    if record_type == "userdetail":
+        # 用户详细信息保存客户端提交的完整数据
+        payload = {key: value for key, value in body.items() if key != "type"}
     else:
-        return {
-            "status": {},
-            "skills": {},
-            "userdetail": {},
-            "history": [],
-            "last_updated": datetime.datetime.now().isoformat()
-        }
-
-# 保存整合数据
-def save_consolidated_data(data):
-    with open(CONSOLIDATED_DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
-    def _set_headers(self, content_type='application/json', status_code=200):
+        payload = body.get("data", {})
+    
+    return {
+        "type": record_type,
+        "username": body.get('username', 'unknown'),
+        "timestamp": body.get('timestamp', datetime.datetime.now().isoformat()),
+        "data": payload,
+        "received": received or datetime.datetime.now().isoformat()
+    }
+
+# 记录类型对应的整合数据字段
+def record_section(record_type):
+    return "skills" if record_type == "skill" else record_type
+
+# 将一条记录应用到整合数据上, 记录中的数据已替换为快照引用
+def apply_record(consolidated_data, record):
+    record_type = record["type"]
+    username = record["username"]
+    timestamp = record["timestamp"]
+    
+    # 更新对应类型的最新数据
+    consolidated_data[record_section(record_type)][username] = {
+        "ref": record["ref"],
+        "timestamp": timestamp
+    }
+    
+    # 更新时间
+    consolidated_data["last_updated"] = record.get("received", datetime.datetime.now().isoformat())
+
+# 由记录生成历史记录条目
+def make_history_entry(record):
+    return {
+        "type": record["type"],
+        "username": record["username"],
+        "timestamp": record["timestamp"],
+        "ref": record["ref"]
+    }
+
+# 历史记录分页游标与 URL 安全字符串之间的转换
+# 游标由时间戳和记录位置组成, 位置的形式取决于存储方式: 分段文件中为 (日期, 偏移), SQLite 中为行号
+def encode_history_cursor(cursor):
+    if cursor is None:
+        return None
+    text = json_codec.dumps(list(cursor), pretty=False)
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+def decode_history_cursor(text):
+    """游标不合法时抛出 ValueError"""
+    try:
+        timestamp, position = json_codec.loads(base64.urlsafe_b64decode(text.encode('ascii')))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {text}")
+    if not isinstance(timestamp, str) or not isinstance(position, (list, int)):
+        raise ValueError(f"Invalid cursor: {text}")
+    return timestamp, tuple(position) if isinstance(position, list) else position
+
+class MemoryStore:
+    """内存常驻存储
+    
+    整合数据常驻进程内存并作为唯一的数据来源, 读请求不会访问磁盘。
+    写入只修改内存并累计脏记录数, 后台线程在达到时间间隔或脏记录数阈值时
+    把内存状态写成快照(临时文件加重命名), 关闭时再写一次最终快照。
+    历史记录不放在快照中, 而是追加写入按天分段的历史记录文件。
+    数据内容按哈希只保存一次, 整合数据和历史记录中只保存引用, 重复提交相同的快照只增加一条时间戳记录;
+    新快照以同一用户同一类型的上一个快照为基准保存字段差异, 并定期保存关键帧。
+    """
+    
+    flush_interval = SNAPSHOT_INTERVAL
+    flush_threshold = SNAPSHOT_DIRTY_THRESHOLD
+    thread_name = "snapshotter"
+    
+    def __init__(self, flush_interval=None, flush_threshold=None, history_retention_days=HISTORY_RETENTION_DAYS,
+                 keyframe_interval=BLOB_KEYFRAME_INTERVAL, commit_window=None):
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if flush_threshold is not None:
+            self.flush_threshold = flush_threshold
+        self.lock = threading.RLock()
+        self.data = None
+        self.blobs = BlobStore(BLOB_FILE, keyframe_interval=keyframe_interval)
+        self.history = HistorySegments(HISTORY_DIR, retention_days=history_retention_days)
+        self.dirty = 0  # 上次快照之后的写入次数
+        # 每次写入递增的版本号, 与本次启动的随机标识一起作为 /api/data 的 ETag
+        self.version = 0
+        self.epoch = os.urandom(4).hex()
+        self.events = None  # 有订阅者时在锁内向其发布变化事件
+        self.ingest_stats = IngestStats(RECORD_TYPE_NAMES)
+        self._stop = threading.Event()
+        self._flush_needed = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._snapshot_refs = set()  # 磁盘上最近一次快照引用的数据内容
+        self._thread = None
+    
+    def open(self):
+        """加载整合数据并启动后台快照线程"""
+        self.blobs.open()
+        self.history.open()
+        self.data = self._recover()
+        
+        # 旧版本在整合数据中直接保存数据内容, 替换为快照引用
+        for section in RECORD_SECTIONS:
+            for username, entry in self.data[section].items():
+                if "data" in entry:
+                    self.data[section][username] = self._intern(entry)
+                    self.dirty += 1
+        
+        # 旧版本把历史记录保存在整合数据文件中, 迁移到分段文件
+        legacy_history = self.data.pop("history", None)
+        if legacy_history:
+            self.history.append(self._intern_batch(legacy_history))
+            self.dirty += 1
+            logger.info(f"已将 {len(legacy_history)} 条历史记录迁移到分段文件")
+        if self.dirty:
+            self.flush()
+        self._snapshot_refs = self._data_refs()
+        for record_type in RECORD_TYPE_NAMES:
+            for username, entry in self.data[record_section(record_type)].items():
+                self.ingest_stats.load(record_type, username, entry["timestamp"])
+        self._thread = threading.Thread(target=self._flush_loop, name=self.thread_name, daemon=True)
+        self._thread.start()
+        if self.dirty >= self.flush_threshold:
+            self._flush_needed.set()
+    
+    def _recover(self):
+        return load_consolidated_data()
+    
+    def _intern(self, record, base=None):
+        """把记录中的数据内容存入快照表, 替换为引用"""
+        if "data" not in record:
+            return record
+        interned = {key: value for key, value in record.items() if key != "data"}
+        interned["ref"] = self.blobs.put(record["data"], base=base)
+        return interned
+    
+    def _intern_batch(self, records):
+        """把一批记录存入快照表, 以同一用户同一类型的上一个快照作为差异基准"""
+        bases = {}
+        interned = []
+        for record in records:
+            key = (record["type"], record["username"])
+            if key not in bases:
+                entry = self.data[record_section(record["type"])].get(record["username"]) if self.data else None
+                bases[key] = entry.get("ref") if entry else None
+            record = self._intern(record, base=bases[key])
+            bases[key] = record.get("ref")
+            interned.append(record)
+        return interned
+    
+    def resolve(self, entry):
+        """把引用替换为实际的数据内容"""
+        if "ref" not in entry:
+            return entry
+        resolved = {key: value for key, value in entry.items() if key != "ref"}
+        resolved["data"] = self.blobs.get(entry["ref"])
+        return resolved
+    
+    def resolve_section(self, section):
+        """返回某一字段下所有用户的完整数据, 需在锁内调用"""
+        return {username: self.resolve(entry) for username, entry in self.data[section].items()}
+    
+    def section(self, name):
+        """返回某一字段下所有用户的完整数据"""
+        with self.lock:
+            return self.resolve_section(name)
+    
+    def query_history(self, username=None, record_type=None, since=None, until=None, limit=None):
+        """通过索引查询历史记录并展开引用, 返回 (命中总数, 记录列表)"""
+        total, entries = self.history.query(username=username, record_type=record_type,
+                                            since=since, until=until, limit=limit)
+        return total, [self.resolve(entry) for entry in entries]
+    
+    def iter_history(self):
+        """按分段顺序遍历全部历史记录并展开引用"""
+        for entry in self.history.read():
+            yield self.resolve(entry)
+    
+    def stats(self):
+        """返回写入时增量维护的统计信息"""
+        with self.lock:
+            # 历史记录条数直接取自索引, 过期分段被删除后也是准确的
+            history_counts = {record_type: len(self.history.index_by_type.get(record_type, ()))
+                              for record_type in RECORD_TYPE_NAMES}
+            stats = self.ingest_stats.summary(history_counts, self.data["last_updated"])
+            stats["unique_snapshots"] = len(self.blobs)
+            return stats
+    
+    def etag(self):
+        """当前数据版本对应的 ETag"""
+        return f'"{self.epoch}-{self.version}"'
+    
+    def export_data(self, fields=DATA_FIELDS, users=None, history_limit=HISTORY_RECENT_LIMIT, cursor=None):
+        """返回引用展开后的整合数据
+        
+        fields 选择返回的字段, users 给出时只返回这些用户的数据;
+        历史记录从 cursor 开始向前分页, 返回 (数据, 下一页游标)。
+        """
+        data = {}
+        with self.lock:
+            for key in fields:
+                if key in RECORD_SECTIONS:
+                    section = self.data[key]
+                    if users is not None:
+                        section = {username: section[username] for username in users if username in section}
+                    data[key] = {username: self.resolve(entry) for username, entry in section.items()}
+                elif key in self.data:
+                    data[key] = self.data[key]
+        next_cursor = None
+        if "history" in fields:
+            entries, next_cursor = self.history.page(usernames=users, cursor=cursor, limit=history_limit)
+            data["history"] = [self.resolve(entry) for entry in entries]
+        return data, next_cursor
+    
+    def _previous(self, record_type, username):
+        """用户某一类型当前的数据内容, 需在锁内调用"""
+        entry = self.data[record_section(record_type)].get(username)
+        return self.blobs.get(entry["ref"]) if entry else None
+    
+    def record_batch(self, records):
+        """在一次状态修改中应用多条记录"""
+        with self.lock:
+            changes = describe_changes(records, self._previous) if self.events else None
+            self.ingest_stats.record(records)
+            records = self._intern_batch(records)
+            self._persist(records)
+            for record in records:
+                apply_record(self.data, record)
+            self.history.append([make_history_entry(record) for record in records])
+            self.dirty += len(records)
+            self.version += 1
+            if changes:
+                self.events.publish(changes)
+            if self.dirty >= self.flush_threshold:
+                self._flush_needed.set()
+    
+    def _persist(self, records):
+        pass
+    
+    def _checkpoint(self):
+        """在锁内序列化当前状态, 返回快照文本"""
+        return dump_consolidated_data(self.data)
+    
+    def _after_flush(self):
+        pass
+    
+    def _data_refs(self):
+        """当前整合数据引用的数据内容, 需在锁内调用"""
+        return {entry["ref"] for section in RECORD_SECTIONS for entry in self.data[section].values() if "ref" in entry}
+    
+    def _recovery_refs(self):
+        """崩溃恢复时除快照和历史记录外还会用到的数据内容"""
+        return set()
+    
+    def compact_blobs(self):
+        """删除快照表中不再被当前数据、磁盘上的快照和历史记录引用的数据内容, 返回删除的快照数"""
+        with self._flush_lock, self.lock:
+            live = self._data_refs() | self._snapshot_refs | self._recovery_refs()
+            live.update(entry["ref"] for entry in self.history.read() if "ref" in entry)
+            return self.blobs.compact(live)
+    
+    def flush(self):
+        """把脏状态写入磁盘"""
+        with self._flush_lock:
+            with self.lock:
+                if self.dirty == 0:
+                    return
+                started = time.perf_counter()
+                text = self._checkpoint()
+                snapshot_refs = self._data_refs()
+                self.dirty = 0
+            # 快照引用的数据内容必须先于快照落盘
+            self.blobs.sync()
+            self.history.sync()
+            write_file_atomic(CONSOLIDATED_DATA_FILE, text)
+            self._snapshot_refs = snapshot_refs
+            SAVE_DURATION.observe(time.perf_counter() - started)
+            self._after_flush()
+    
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._flush_needed.wait(self.flush_interval)
+            self._flush_needed.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.flush()
+                # 删除过期的历史记录分段后, 只被这些记录引用的数据内容也一并删除
+                if self.history.prune():
+                    self.compact_blobs()
+            except Exception as e:
+                logger.error(f"写入整合数据快照时出错: {str(e)}")
+    
+    def close(self):
+        """停止后台线程并写出最终快照"""
+        self._stop.set()
+        self._flush_needed.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        self.history.close()
+        self.blobs.close()
+
+class WalStore(MemoryStore):
+    """追加写日志存储
+    
+    在内存常驻存储的基础上, 每次写入还向日志末尾追加一行紧凑的JSON记录。
+    启动时从最近的检查点(整合数据文件)加上日志尾部重建内存状态,
+    后台线程定期把内存状态写成新的检查点并删除已被覆盖的日志分段。
+    写入在日志落盘后才返回, 同一时间窗口内的并发写入通过组提交共享一次 fsync。
+    """
+    
+    flush_interval = WAL_COMPACT_INTERVAL
+    flush_threshold = WAL_COMPACT_THRESHOLD
+    thread_name = "wal-compactor"
+    
+    def __init__(self, flush_interval=None, flush_threshold=None, history_retention_days=HISTORY_RETENTION_DAYS,
+                 keyframe_interval=BLOB_KEYFRAME_INTERVAL, commit_window=None):
+        super().__init__(flush_interval, flush_threshold, history_retention_days, keyframe_interval)
+        self.seq = 0  # 最后一条已应用记录的序号
+        self.segment = 0  # 当前日志分段编号
+        self.covered_segment = 0  # 最近一次检查点已覆盖的日志分段编号
+        self.wal = None
+        self.history.durable = True
+        self.commits = GroupCommit(self._sync, GROUP_COMMIT_WINDOW if commit_window is None else commit_window)
+    
+    def _segment_path(self, number):
+        return f"{WAL_FILE_PREFIX}.{number:06d}"
+    
+    def _list_segments(self):
+        segments = []
+        for path in glob.glob(f"{WAL_FILE_PREFIX}.*"):
+            suffix = path.rsplit('.', 1)[1]
+            if suffix.isdigit():
+                segments.append(int(suffix))
+        return sorted(segments)
+    
+    def _recover(self):
+        """从检查点和日志尾部重建内存状态"""
+        data = load_consolidated_data()
+        checkpoint_seq = data.pop("wal_seq", 0)
+        self.seq = checkpoint_seq
+        
+        segments = self._list_segments()
+        replayed = 0
+        for number in segments:
+            with open(self._segment_path(number), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json_codec.loads(line)
+                    except json_codec.JSONDecodeError:
+                        # 崩溃时最后一行可能只写了一半, 直接丢弃
+                        logger.warning(f"跳过损坏的日志记录: {self._segment_path(number)}")
+                        continue
+                    if record["seq"] <= checkpoint_seq:
+                        continue
+                    apply_record(data, self._intern(record))
+                    self.seq = record["seq"]
+                    replayed += 1
+        
+        self.dirty = replayed
+        self.segment = (segments[-1] + 1) if segments else 1
+        self.wal = open(self._segment_path(self.segment), 'a', encoding='utf-8')
+        logger.info(f"已从检查点恢复整合数据 (检查点序号: {checkpoint_seq}, 重放日志记录: {replayed})")
+        return data
+    
+    def record_batch(self, records):
+        with self.lock:
+            super().record_batch([dict(record, seq=self.seq + i) for i, record in enumerate(records, 1)])
+            seq = self.seq
+            # 历史记录写入后才登记, 组提交落盘的历史记录包含本批, 日志中已落盘的记录都有对应的历史记录
+            self.commits.written(seq)
+        # 在锁外等待本批记录落盘, 其他线程可以继续写入并加入同一组提交
+        self.commits.wait(seq)
+    
+    def _persist(self, records):
+        # 一批记录只写一次日志
+        self.wal.write("".join(json_codec.dumps(record, pretty=False) + "\n" for record in records))
+        self.wal.flush()
+        self.seq = records[-1]["seq"]
+    
+    def _sync(self):
+        """依次把数据快照、历史记录和日志落盘, 日志最后落盘, 保证日志中的引用都已存在"""
+        self.blobs.sync()
+        self.history.sync()
+        with self.lock:
+            fd = os.dup(self.wal.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def _checkpoint(self):
+        # 切换到新的日志分段, 之后的写入不会影响本次检查点
+        text = json_codec.dumps(dict(self.data, wal_seq=self.seq), pretty=False)
+        self.covered_segment = self.segment
+        os.fsync(self.wal.fileno())  # 正在等待组提交的写入可能还在旧分段中
+        self.wal.close()
+        self.segment += 1
+        self.wal = open(self._segment_path(self.segment), 'a', encoding='utf-8')
+        return text
+    
+    def _recovery_refs(self):
+        # 检查点之后的日志记录在恢复时重放, 其中可能有已被覆盖且历史记录分段已过期的数据内容
+        refs = set()
+        for number in self._list_segments():
+            if number <= self.covered_segment:
+                continue
+            with open(self._segment_path(number), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json_codec.loads(line)
+                    except json_codec.JSONDecodeError:
+                        continue
+                    if "ref" in record:
+                        refs.add(record["ref"])
+        return refs
+    
+    def _after_flush(self):
+        for number in self._list_segments():
+            if number <= self.covered_segment:
+                os.remove(self._segment_path(number))
+        logger.info(f"日志压缩完成, 已删除分段 {self.covered_segment} 及之前的日志")
+    
+    def close(self):
+        super().close()
+        with self.lock:
+            self.wal.close()
+
+class SqlStore(SqliteStore):
+    """使用 SQLite 数据库的存储模式, 数据库位于数据目录下"""
+    
+    def __init__(self, **options):
+        # 快照写回和历史记录分段的参数对 SQLite 存储没有意义
+        super().__init__(SQLITE_FILE, {record_section(record_type): record_type for record_type in RECORD_TYPE_NAMES})
+
+STORAGE_BACKENDS = {
+    "snapshot": MemoryStore,
+    "wal": WalStore,
+    "sqlite": SqlStore,
+}
+
+def create_store(storage, flush_interval=None, flush_threshold=None, history_retention_days=HISTORY_RETENTION_DAYS,
+                 keyframe_interval=BLOB_KEYFRAME_INTERVAL, commit_window=None):
+    """根据存储模式创建存储对象"""
+    if storage not in STORAGE_BACKENDS:
+        raise ValueError(f"未知的存储模式: {storage}")
+    return STORAGE_BACKENDS[storage](flush_interval=flush_interval, flush_threshold=flush_threshold,
+                                     history_retention_days=history_retention_days,
+                                     keyframe_interval=keyframe_interval, commit_window=commit_window)
+
+class CivitasDataHandler(InstrumentedHandlerMixin, http.server.BaseHTTPRequestHandler):
+    # 使用 HTTP/1.1 以支持长连接, 因此每个响应都必须带上 Content-Length
+    protocol_version = 'HTTP/1.1'
+    # 空闲长连接的超时时间(秒), 避免占满工作线程
+    timeout = KEEP_ALIVE_TIMEOUT
+    # 响应头和响应体分两次写出, 关闭 Nagle 算法以免长连接上出现 40ms 的延迟确认等待
+    disable_nagle_algorithm = True
+    
+    def _set_headers(self, content_type='application/json', status_code=200, content_length=0, headers=None):
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(content_length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_header('Access-Control-Allow-Origin', '*')  # 允许所有来源的跨域请求
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Content-Encoding, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+        self.end_headers()
+    
+    def _send_body(self, body, content_type='application/json', status_code=200, headers=None, compressed=None):
+        """发送带有正确 Content-Length 的完整响应
+        
+        客户端接受 gzip 且响应体足够大时压缩后发送, compressed 为预先压缩好的内容。
+        """
+        if len(body) >= GZIP_MIN_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            headers = dict(headers or {}, Vary='Accept-Encoding')
+            if self._accepts_gzip():
+                body = compressed if compressed is not None else gzip.compress(body, compresslevel=GZIP_LEVEL)
+                headers['Content-Encoding'] = 'gzip'
+        self._set_headers(content_type=content_type, status_code=status_code, content_length=len(body), headers=headers)
+        self.wfile.write(body)
+    
+    def _accepts_gzip(self):
+        """根据 Accept-Encoding 判断客户端是否接受 gzip"""
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, *params = [part.strip() for part in coding.split(';')]
+            if name.lower() not in ('gzip', '*'):
+                continue
+            for param in params:
+                if param.startswith('q='):
+                    try:
+                        return float(param[2:]) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+    
+    def _not_modified(self, etag, headers=None):
+        """客户端缓存的 ETag 仍然有效时返回 304 响应"""
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' not in tags and etag not in [tag[2:] if tag.startswith('W/') else tag for tag in tags]:
+            return False
+        # 304 响应没有响应体
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
+        return True
     
     def do_OPTIONS(self):
         """处理 OPTIONS 请求，支持 CORS 预检请求"""
@@ -125,8 +712,6 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
         parsed_url = urlparse(self.path)
         path = parsed_url.path
         
-        logger.info(f"收到GET请求: {path}")
-        
         # 检查是否是请求静态文件
         if path == '/visualization/':
             # 直接提供可视化页面的index.html
@@ -148,7 +733,7 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
         elif path == '/visualization':
             self._redirect_to('/visualization/')
         elif path == '/api/data':
-            self._get_consolidated_data()
+            self._get_consolidated_data(parse_qs(parsed_url.query))
         elif path.startswith('/api/get_record/'):
             filename = path.split('/api/get_record/')[1]
             self._get_record(filename)
@@ -156,65 +741,81 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
             self._get_stats()
         elif path == '/api/user_detail':
             self._get_user_detail()
+        elif path == '/api/history':
+            self._get_history(parse_qs(parsed_url.query))
+        elif path == '/api/export_columnar':
+            self._export_columnar()
+        elif path == '/api/events':
+            self._stream_events()
+        elif path == '/metrics':
+            self._send_body(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
         else:
-            logger.warning(f"未找到路径: {path}")
-            self._set_headers(status_code=404)
-            self.wfile.write(json.dumps({"status": 0, "message": "Not found"}).encode())
+            self._send_body(json_codec.dumpb({"status": 0, "message": "Not found"}), status_code=404)
     
     def _redirect_to(self, url):
         """重定向到指定URL"""
         self.send_response(302)
         self.send_header('Location', url)
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def _serve_static_file(self, file_path):
-        """提供静态文件"""
-        logger.info(f"尝试提供静态文件: {file_path}")
-        full_path = os.path.join(VISUALIZATION_DIR, file_path)
-        logger.info(f"完整文件路径: {full_path}")
-        
-        if not os.path.exists(full_path):
-            logger.error(f"文件不存在: {full_path}")
-            self._set_headers(status_code=404)
-            self.wfile.write(b"File not found")
+        """从内存缓存提供静态文件, 支持 ETag 和 Last-Modified 条件请求"""
+        asset = self.server.static_assets.get(file_path)
+        if asset is None:
+            self._send_body(b"File not found", status_code=404)
             return
         
-        if os.path.isdir(full_path):
-            logger.error(f"请求的是目录而非文件: {full_path}")
-            self._set_headers(status_code=404)
-            self.wfile.write(b"File not found (is a directory)")
+        headers = {'Cache-Control': 'no-cache', 'Last-Modified': asset.last_modified}
+        if self._not_modified(asset.etag, headers=headers) or self._not_modified_since(asset, headers):
             return
-        
-        # 设置合适的内容类型
-        content_type = 'text/plain'
-        if file_path.endswith('.html'):
-            content_type = 'text/html'
-        elif file_path.endswith('.css'):
-            content_type = 'text/css'
-        elif file_path.endswith('.js'):
-            content_type = 'application/javascript'
-        elif file_path.endswith('.json'):
-            content_type = 'application/json'
+        headers['ETag'] = asset.etag
         
         try:
-            with open(full_path, 'rb') as f:
-                content = f.read()
-            logger.info(f"成功读取文件: {full_path} (大小: {len(content)} 字节)")
-            self._set_headers(content_type=content_type)
-            self.wfile.write(content)
-            logger.info(f"成功提供文件: {full_path}")
+            if asset.content is not None:
+                self._send_body(asset.content, content_type=asset.content_type, headers=headers,
+                                compressed=asset.gzipped)
+                return
+            # 大文件直接由内核从文件发送到套接字
+            with open(asset.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self._set_headers(content_type=asset.content_type, content_length=size, headers=headers)
+                self.connection.sendfile(f, 0, size)
+                self.wfile.bytes += size  # sendfile 不经过 wfile, 手动计入响应字节数
         except Exception as e:
             logger.error(f"提供静态文件时出错: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(b"Server error")
+            self.close_connection = True
+    
+    def _not_modified_since(self, asset, headers):
+        """没有 If-None-Match 时按 If-Modified-Since 判断文件是否修改"""
+        if self.headers.get('If-None-Match') or not self.headers.get('If-Modified-Since'):
+            return False
+        try:
+            since = parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp()
+        except (TypeError, ValueError):
+            return False
+        if asset.mtime_ns // 1_000_000_000 > since:
+            return False
+        self.send_response(304)
+        for name, value in dict(headers, ETag=asset.etag).items():
+            self.send_header(name, value)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        return True
     
     def do_POST(self):
         """处理 POST 请求"""
-        content_length = int(self.headers['Content-Length'])
+        content_length = int(self.headers.get('Content-Length', 0))
         post_data = self.rfile.read(content_length)
         
         try:
-            data = json.loads(post_data.decode('utf-8'))
+            post_data = decode_request_body(post_data, self.headers.get('Content-Encoding'))
+        except RequestBodyError as e:
+            self._send_body(json_codec.dumpb({"status": 0, "message": e.message}), status_code=e.status_code)
+            return
+        
+        try:
+            data = json_codec.loads(post_data)
             
             if self.path == '/api/record_status':
                 self._record_status(data)
@@ -222,16 +823,15 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
                 self._record_skill(data)
             elif self.path == '/api/record_userdetail':
                 self._record_userdetail(data)
+            elif self.path == '/api/record_batch':
+                self._record_batch(data)
             else:
-                self._set_headers(status_code=404)
-                self.wfile.write(json.dumps({"status": 0, "message": "Not found"}).encode())
-        except json.JSONDecodeError:
-            self._set_headers(status_code=400)
-            self.wfile.write(json.dumps({"status": 0, "message": "Invalid JSON"}).encode())
+                self._send_body(json_codec.dumpb({"status": 0, "message": "Not found"}), status_code=404)
+        except json_codec.JSONDecodeError:
+            self._send_body(json_codec.dumpb({"status": 0, "message": "Invalid JSON"}), status_code=400)
         except Exception as e:
             logger.error(f"处理请求时发生错误: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Server error: {str(e)}"}).encode())
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Server error: {str(e)}"}), status_code=500)
     
     def _serve_home_page(self):
         """提供主页 HTML"""
@@ -273,8 +873,13 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
                 </div>
                 
                 <div class="endpoint">
-                    <p><span class="method">GET</span> /api/data</p>
-                    <p>获取整合后的数据</p>
+                    <p><span class="method">POST</span> /api/record_batch</p>
+                    <p>批量记录多条数据 (状态、技能、用户详细信息)</p>
+                </div>
+                
+                <div class="endpoint">
+                    <p><span class="method">GET</span> /api/data?fields=&amp;users=&amp;history_limit=&amp;cursor=</p>
+                    <p>获取整合后的数据, 可选择字段、筛选用户并分页读取历史记录, 支持 ETag 条件请求</p>
                 </div>
                 
                 <div class="endpoint">
@@ -286,11 +891,20 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
                     <p><span class="method">GET</span> /api/user_detail</p>
                     <p>获取用户详细信息</p>
                 </div>
+                
+                <div class="endpoint">
+                    <p><span class="method">GET</span> /api/history?username=&amp;type=&amp;since=&amp;until=&amp;limit=</p>
+                    <p>按用户、类型和时间范围查询历史记录</p>
+                </div>
+                
+                <div class="endpoint">
+                    <p><span class="method">GET</span> /api/export_columnar</p>
+                    <p>把状态和技能历史导出为按列保存的 .npy 文件</p>
+                </div>
             </body>
         </html>
         """
-        self._set_headers(content_type='text/html')
-        self.wfile.write(html.encode())
+        self._send_body(html.encode(), content_type='text/html')
     
     def _serve_visualization(self):
         """提供可视化页面"""
@@ -299,8 +913,7 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
         
         if not os.path.exists(visualization_file):
             logger.error(f"可视化文件不存在: {visualization_file}")
-            self._set_headers(content_type='text/html')
-            self.wfile.write("""
+            self._send_body("""
             <html>
                 <head><title>Error</title></head>
                 <body>
@@ -308,20 +921,18 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
                     <p>请确保visualization/index.html已正确创建。</p>
                 </body>
             </html>
-            """.encode())
+            """.encode(), content_type='text/html')
             return
         
         try:
             logger.info(f"正在读取文件: {visualization_file}")
             with open(visualization_file, 'rb') as f:
                 content = f.read()
-            self._set_headers(content_type='text/html')
-            self.wfile.write(content)
+            self._send_body(content, content_type='text/html')
             logger.info(f"成功提供可视化页面: {visualization_file}")
         except Exception as e:
             logger.error(f"提供可视化页面时出错: {str(e)}")
-            self._set_headers(content_type='text/html', status_code=500)
-            self.wfile.write(f"""
+            self._send_body(f"""
             <html>
                 <head><title>Error</title></head>
                 <body>
@@ -329,222 +940,416 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
                     <p>{str(e)}</p>
                 </body>
             </html>
-            """.encode())
+            """.encode(), content_type='text/html', status_code=500)
     
     def _record_status(self, data):
         """记录状态数据"""
+        self._record_single("status", data)
+    
+    def _record_skill(self, data):
+        """记录技能数据"""
+        self._record_single("skill", data)
+    
+    def _record_userdetail(self, data):
+        """记录用户详细信息"""
+        self._record_single("userdetail", data)
+    
+    def _record_single(self, record_type, data):
+        """记录单条数据, 是批量记录的简单包装"""
+        label = RECORD_TYPE_LABELS[record_type]
         try:
             if not data:
-                self._set_headers(status_code=400)
-                self.wfile.write(json.dumps({"status": 0, "message": "No data provided"}).encode())
+                self._send_body(json_codec.dumpb({"status": 0, "message": "No data provided"}), status_code=400)
                 return
             
-            # 确保有基本信息
-            username = data.get('username', 'unknown')
-            timestamp = data.get('timestamp', datetime.datetime.now().isoformat())
-            
-            # 加载整合数据
-            consolidated_data = load_consolidated_data()
-            
-            # 更新状态数据
-            consolidated_data["status"][username] = {
-                "data": data.get("data", {}),
-                "timestamp": timestamp
-            }
-            
-            # 添加历史记录
-            history_entry = {
-                "type": "status",
-                "username": username,
-                "timestamp": timestamp,
-                "data": data.get("data", {})
-            }
-            consolidated_data["history"].append(history_entry)
-            
-            # 限制历史记录长度
-            if len(consolidated_data["history"]) > 1000:
-                consolidated_data["history"] = consolidated_data["history"][-1000:]
-            
-            # 更新时间
-            consolidated_data["last_updated"] = datetime.datetime.now().isoformat()
-            
-            # 保存更新后的数据
-            save_consolidated_data(consolidated_data)
+            result = self._apply_records([dict(data, type=record_type)])[0]
+            if result["status"] != 1:
+                self._send_body(json_codec.dumpb(result), status_code=400)
+                return
             
-            logger.info(f"状态数据已记录: {username}")
-            self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "message": "Status data recorded successfully"}).encode())
+            self._send_body(json_codec.dumpb({"status": 1, "message": f"{label} recorded successfully"}))
         
         except Exception as e:
-            logger.error(f"记录状态数据时出错: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error recording status data: {str(e)}"}).encode())
+            logger.error(f"记录{RECORD_TYPE_NAMES[record_type]}数据时出错: {str(e)}")
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Error recording {label.lower()}: {str(e)}"}), status_code=500)
     
-    def _record_skill(self, data):
-        """记录技能数据"""
+    def _record_batch(self, data):
+        """批量记录多条数据, 所有记录在一次状态修改中应用"""
         try:
-            if not data:
-                self._set_headers(status_code=400)
-                self.wfile.write(json.dumps({"status": 0, "message": "No data provided"}).encode())
+            items = data.get("records") if isinstance(data, dict) else data
+            if not isinstance(items, list) or not items:
+                self._send_body(json_codec.dumpb({"status": 0, "message": "No records provided"}), status_code=400)
                 return
             
-            # 确保有基本信息
-            username = data.get('username', 'unknown')
-            timestamp = data.get('timestamp', datetime.datetime.now().isoformat())
-            
-            # 加载整合数据
-            consolidated_data = load_consolidated_data()
-            
-            # 更新技能数据
-            consolidated_data["skills"][username] = {
-                "data": data.get("data", {}),
-                "timestamp": timestamp
-            }
-            
-            # 添加历史记录
-            history_entry = {
-                "type": "skill",
-                "username": username,
-                "timestamp": timestamp,
-                "data": data.get("data", {})
-            }
-            consolidated_data["history"].append(history_entry)
-            
-            # 限制历史记录长度
-            if len(consolidated_data["history"]) > 1000:
-                consolidated_data["history"] = consolidated_data["history"][-1000:]
-            
-            # 更新时间
-            consolidated_data["last_updated"] = datetime.datetime.now().isoformat()
-            
-            # 保存更新后的数据
-            save_consolidated_data(consolidated_data)
-            
-            logger.info(f"技能数据已记录: {username}")
-            self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "message": "Skill data recorded successfully"}).encode())
+            results = self._apply_records(items)
+            recorded = sum(1 for result in results if result["status"] == 1)
+            self._send_body(json_codec.dumpb({
+                "status": 1 if recorded == len(results) else 0,
+                "message": f"{recorded}/{len(results)} records recorded",
+                "results": results
+            }))
         
         except Exception as e:
-            logger.error(f"记录技能数据时出错: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error recording skill data: {str(e)}"}).encode())
+            logger.error(f"批量记录数据时出错: {str(e)}")
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Error recording batch: {str(e)}"}), status_code=500)
     
-    def _record_userdetail(self, data):
-        """记录用户详细信息"""
+    def _apply_records(self, items):
+        """校验并写入多条记录, 返回与输入一一对应的结果"""
+        received = datetime.datetime.now().isoformat()
+        results = []
+        records = []
+        for item in items:
+            try:
+                record = build_record(item, received)
+            except ValueError as e:
+                results.append({"status": 0, "message": str(e)})
+                continue
+            records.append(record)
+            results.append({"status": 1, "type": record["type"], "username": record["username"]})
+        
+        if records:
+            self.server.store.record_batch(records)
+            if logger.isEnabledFor(logging.DEBUG):
+                for record in records:
+                    logger.debug(f"{RECORD_TYPE_NAMES[record['type']]}数据已记录: {record['username']}")
+        return results
+    
+    def _get_consolidated_data(self, query):
+        """获取整合的数据
+        
+        支持 fields= 选择字段, users= 筛选用户, history_limit= 和 cursor= 分页读取历史记录;
+        数据没有变化时对 If-None-Match 返回 304。
+        """
         try:
-            if not data:
-                self._set_headers(status_code=400)
-                self.wfile.write(json.dumps({"status": 0, "message": "No data provided"}).encode())
+            store = self.server.store
+            # 先取 ETag 再读取数据, 读取期间发生的写入只会让 ETag 比数据旧, 不会漏掉更新
+            etag = store.etag()
+            cache_headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+            if self._not_modified(etag, headers={'Cache-Control': 'no-cache'}):
                 return
             
-            # 确保有基本信息
-            username = data.get('username', 'unknown')
-            timestamp = data.get('timestamp', datetime.datetime.now().isoformat())
-            
-            # 加载整合数据
-            consolidated_data = load_consolidated_data()
-            
-            # 更新用户详细信息
-            consolidated_data["userdetail"][username] = {
-                "data": data,
-                "timestamp": timestamp
-            }
-            
-            # 添加历史记录
-            history_entry = {
-                "type": "userdetail",
-                "username": username,
-                "timestamp": timestamp,
-                "data": data
-            }
-            consolidated_data["history"].append(history_entry)
-            
-            # 限制历史记录长度
-            if len(consolidated_data["history"]) > 1000:
-                consolidated_data["history"] = consolidated_data["history"][-1000:]
-            
-            # 更新时间
-            consolidated_data["last_updated"] = datetime.datetime.now().isoformat()
-            
-            # 保存更新后的数据
-            save_consolidated_data(consolidated_data)
-            
-            self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "message": "User detail recorded successfully"}).encode())
+            fields = DATA_FIELDS
+            if 'fields' in query:
+                fields = [field for field in query['fields'][0].split(',') if field]
+                unknown = [field for field in fields if field not in DATA_FIELDS]
+                if unknown:
+                    self._send_body(json_codec.dumpb({"status": 0, "message": f"Unknown fields: {', '.join(unknown)}"}), status_code=400)
+                    return
+            users = [user for user in query['users'][0].split(',') if user] if 'users' in query else None
+            try:
+                history_limit = int(query.get('history_limit', [HISTORY_RECENT_LIMIT])[0])
+                cursor = decode_history_cursor(query['cursor'][0]) if 'cursor' in query else None
+            except ValueError:
+                self._send_body(json_codec.dumpb({"status": 0, "message": "Invalid history_limit or cursor"}), status_code=400)
+                return
+            if history_limit <= 0:
+                self._send_body(json_codec.dumpb({"status": 0, "message": "Invalid history_limit or cursor"}), status_code=400)
+                return
             
-        except Exception as e:
-            logger.error(f"记录用户详细信息时出错: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error recording user detail: {str(e)}"}).encode())
-    
-    def _get_consolidated_data(self):
-        """获取整合的数据"""
-        try:
-            consolidated_data = load_consolidated_data()
-            self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "data": consolidated_data}).encode())
+            data, next_cursor = store.export_data(fields=fields, users=users,
+                                                  history_limit=min(history_limit, HISTORY_QUERY_MAX_LIMIT), cursor=cursor)
+            response = {"status": 1, "data": data}
+            if "history" in fields:
+                response["history_cursor"] = encode_history_cursor(next_cursor)
+            self._send_body(json_codec.dumpb(response), headers=cache_headers)
         except Exception as e:
             logger.error(f"获取整合数据时出错: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error getting consolidated data: {str(e)}"}).encode())
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Error getting consolidated data: {str(e)}"}), status_code=500)
     
     def _get_stats(self):
         """获取统计信息"""
         try:
-            consolidated_data = load_consolidated_data()
-            
-            status_users = list(consolidated_data["status"].keys())
-            skill_users = list(consolidated_data["skills"].keys())
-            userdetail_users = list(consolidated_data["userdetail"].keys())
-            all_users = list(set(status_users + skill_users + userdetail_users))
-            
-            stats = {
-                "total_users": len(all_users),
-                "users": all_users,
-                "status_records": len(status_users),
-                "skill_records": len(skill_users),
-                "userdetail_records": len(userdetail_users),
-                "history_records": len(consolidated_data["history"]),
-                "last_updated": consolidated_data["last_updated"]
-            }
-            
-            self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "data": stats}).encode())
+            stats = self.server.store.stats()
+            self._send_body(json_codec.dumpb({"status": 1, "data": stats}))
         
         except Exception as e:
             logger.error(f"获取统计信息时出错: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error getting stats: {str(e)}"}).encode())
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Error getting stats: {str(e)}"}), status_code=500)
 
+    def _get_history(self, query):
+        """按用户、类型和时间范围查询历史记录"""
+        try:
+            username = query.get('username', [None])[0]
+            record_type = query.get('type', [None])[0]
+            since = query.get('since', [None])[0]
+            until = query.get('until', [None])[0]
+            try:
+                limit = int(query.get('limit', [HISTORY_QUERY_DEFAULT_LIMIT])[0])
+            except ValueError:
+                limit = -1
+            if limit < 0:
+                self._send_body(json_codec.dumpb({"status": 0, "message": "Invalid limit"}), status_code=400)
+                return
+            if record_type is not None and record_type not in RECORD_TYPE_NAMES:
+                self._send_body(json_codec.dumpb({"status": 0, "message": f"Unknown record type: {record_type}"}), status_code=400)
+                return
+            
+            total, entries = self.server.store.query_history(
+                username=username,
+                record_type=record_type,
+                since=since,
+                until=until,
+                limit=min(limit, HISTORY_QUERY_MAX_LIMIT)
+            )
+            self._send_body(json_codec.dumpb({"status": 1, "total": total, "data": entries}))
+        except Exception as e:
+            logger.error(f"查询历史记录时出错: {str(e)}")
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Error querying history: {str(e)}"}), status_code=500)
+    
+    def _stream_events(self):
+        """通过 Server-Sent Events 推送变化事件, 连接保持到客户端断开"""
+        broker = self.server.store.events
+        subscription = broker.subscribe()
+        try:
+            # 事件流没有长度, 结束后必须关闭连接
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(b"retry: 3000\n\n")
+            while True:
+                message = subscription.get(timeout=EVENTS_HEARTBEAT_INTERVAL)
+                if subscription.lost:
+                    # 客户端跟不上或服务器正在停止, 断开后客户端会重连并重新获取完整数据
+                    break
+                self.wfile.write(message or b": ping\n\n")
+        except OSError:
+            pass
+        finally:
+            broker.unsubscribe(subscription)
+    
+    def _export_columnar(self):
+        """把状态和技能历史导出为按列保存的 .npy 文件, 返回导出清单"""
+        try:
+            manifest = export_columnar(self.server.store.iter_history(), COLUMNAR_EXPORT_DIR)
+            manifest["path"] = os.path.abspath(COLUMNAR_EXPORT_DIR)
+            self._send_body(json_codec.dumpb({"status": 1, "data": manifest}))
+        except Exception as e:
+            logger.error(f"导出列式数据时出错: {str(e)}")
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Error exporting columnar data: {str(e)}"}), status_code=500)
+    
     def _get_user_detail(self):
         """获取用户详细信息"""
         try:
-            consolidated_data = load_consolidated_data()
-            
-            self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "data": consolidated_data["userdetail"]}).encode())
+            body = json_codec.dumpb({"status": 1, "data": self.server.store.section("userdetail")})
+            self._send_body(body)
         except Exception as e:
             logger.error(f"获取用户详细信息时出错: {str(e)}")
-            self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error getting user detail: {str(e)}"}).encode())
+            self._send_body(json_codec.dumpb({"status": 0, "message": f"Error getting user detail: {str(e)}"}), status_code=500)
+
+class SingleThreadDataHandler(CivitasDataHandler):
+    """单线程引擎使用的处理器: 一个空闲长连接会阻塞所有请求, 因此不启用长连接, 也不提供事件流"""
+    protocol_version = 'HTTP/1.0'
+    
+    def _stream_events(self):
+        self._send_body(json_codec.dumpb({"status": 0, "message": "Event stream is not available with the single engine"}), status_code=503)
 
-def run_server(host='0.0.0.0', port=5000):
+class PooledDataHandler(CivitasDataHandler):
+    """pool 引擎使用的处理器: 事件流会一直占用一个工作线程, 订阅数达到线程数时所有请求都会阻塞, 因此不提供事件流"""
+    
+    def _stream_events(self):
+        self._send_body(json_codec.dumpb({"status": 0, "message": "Event stream is not available with the pool engine"}), status_code=503)
+
+class ThreadingDataServer(http.server.ThreadingHTTPServer):
+    """每个连接一个线程的 HTTP 服务器"""
+    request_queue_size = SERVER_LISTEN_BACKLOG
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """使用固定大小线程池处理连接的 HTTP 服务器"""
+    request_queue_size = SERVER_LISTEN_BACKLOG
+    
+    def __init__(self, server_address, handler_class, max_workers=SERVER_POOL_SIZE):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http-worker")
+    
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_worker, request, client_address)
+    
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+SERVER_ENGINES = {
+    "single": (http.server.HTTPServer, SingleThreadDataHandler),
+    "threaded": (ThreadingDataServer, CivitasDataHandler),
+    "pool": (PooledHTTPServer, PooledDataHandler),
+}
+
+def create_server(engine, server_address, workers=None):
+    """根据引擎名称创建 HTTP 服务器"""
+    if engine not in SERVER_ENGINES:
+        raise ValueError(f"未知的服务器引擎: {engine}")
+    server_class, handler_class = SERVER_ENGINES[engine]
+    if engine == "pool":
+        return server_class(server_address, handler_class, max_workers=workers or SERVER_POOL_SIZE)
+    return server_class(server_address, handler_class)
+
+def store_size():
+    """整合数据存储自己的文件(快照、日志、SQLite 数据库、快照表和历史记录分段)占用的字节数
+
+    数据目录中还有每条记录一个文件的服务器写入的大量记录文件, 只统计存储拥有的文件, 抓取指标时不遍历整个目录。
+    """
+    paths = [BLOB_FILE, *glob.glob(f"{CONSOLIDATED_DATA_FILE}*"), *glob.glob(f"{SQLITE_FILE}*"),
+             *glob.glob(f"{WAL_FILE_PREFIX}.*")]
+    total = 0
+    for path in paths:
+        try:
+            total += os.stat(path).st_size
+        except OSError:
+            pass
+    return total + directory_size(HISTORY_DIR)
+
+def register_store_metrics(store):
+    """注册抓取时从存储读取的数据量指标"""
+    METRICS.gauge("civitas_store_users", "每种类型有最新数据的用户数",
+                  lambda: {(record_type,): store.stats()[f"{record_type}_records"] for record_type in RECORD_TYPE_NAMES},
+                  ("type",))
+    METRICS.gauge("civitas_history_records", "每种类型的历史记录条数",
+                  lambda: {(record_type,): count for record_type, count in store.stats()["history_by_type"].items()},
+                  ("type",))
+    METRICS.gauge("civitas_store_bytes", "整合数据存储的文件占用的字节数", lambda: {(): store_size()})
+    if isinstance(store, WalStore):
+        METRICS.gauge("civitas_wal_group_commits", "日志组提交(fsync)的次数", lambda: {(): store.commits.commits})
+
+def _handle_sigterm(signum, frame):
+    """收到 SIGTERM 时按 Ctrl+C 的流程退出, 以便写出最终快照"""
+    raise KeyboardInterrupt
+
+def import_into_sqlite(batch_size=1000):
+    """把整合数据文件和历史记录分段一次性导入 SQLite 数据库"""
+    # 存在日志分段时按 wal 模式加载, 以包含检查点之后的写入
+    source = create_store("wal" if glob.glob(f"{WAL_FILE_PREFIX}.*") else "snapshot", history_retention_days=0)
+    source.open()
+    target = SqlStore()
+    target.open()
+    try:
+        if target.stats()["history_records"]:
+            logger.error(f"SQLite 数据库中已有历史记录, 不再重复导入: {SQLITE_FILE}")
+            return
+        with source.lock:
+            state = {section: source.resolve_section(section) for section in RECORD_SECTIONS}
+            last_updated = source.data["last_updated"]
+        imported = target.import_state(state, last_updated)
+        logger.info(f"已导入 {imported} 条最新数据")
+        
+        batch = []
+        imported = 0
+        for entry in source.iter_history():
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                target.import_history(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            target.import_history(batch)
+            imported += len(batch)
+        logger.info(f"已导入 {imported} 条历史记录到 {SQLITE_FILE}")
+    finally:
+        target.close()
+        source.close()
+
+def run_server(host='0.0.0.0', port=5000, storage='snapshot', flush_interval=None, flush_threshold=None,
+               engine='threaded', workers=None, history_retention_days=HISTORY_RETENTION_DAYS,
+               keyframe_interval=BLOB_KEYFRAME_INTERVAL, access_log_sample_rates=None, commit_window=None):
     """运行服务器"""
+    # 日志由后台线程写出, 请求线程只把日志记录放入队列
+    queue_logging = QueueLogging()
+    queue_logging.start()
+    
     # 初始化整合数据文件
     init_consolidated_data()
     
+    store = create_store(storage, flush_interval=flush_interval, flush_threshold=flush_threshold,
+                         history_retention_days=history_retention_days, keyframe_interval=keyframe_interval,
+                         commit_window=commit_window)
+    store.open()
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    
     server_address = (host, port)
-    httpd = http.server.HTTPServer(server_address, CivitasDataHandler)
-    logger.info(f"Civitas 数据服务器启动在 http://{host}:{port}")
+    httpd = create_server(engine, server_address, workers=workers)
+    httpd.store = store
+    store.events = EventBroker()
+    httpd.static_assets = StaticAssetCache(VISUALIZATION_DIR, sources=VISUALIZATION_SOURCES,
+                                           gzip_min_size=GZIP_MIN_SIZE, sendfile_min_size=SENDFILE_MIN_SIZE)
+    httpd.metrics = HttpMetrics(METRICS, METRIC_ROUTES)
+    httpd.access_log = AccessLog(dict(ACCESS_LOG_SAMPLE_RATES, **(access_log_sample_rates or {})))
+    register_store_metrics(store)
+    logger.info(f"Civitas 数据服务器启动在 http://{host}:{port} (服务器引擎: {engine})")
     logger.info(f"数据可视化页面地址: http://{host}:{port}/visualization/")
-    logger.info(f"整合数据保存在: {os.path.abspath(CONSOLIDATED_DATA_FILE)}")
+    logger.info(f"整合数据保存在: {os.path.abspath(CONSOLIDATED_DATA_FILE)} (存储模式: {storage})")
     
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         logger.info("服务器已停止")
     finally:
+        store.events.close()
         httpd.server_close()
+        store.close()
+        queue_logging.stop()
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Civitas 整合数据服务器")
+    parser.add_argument('--host', default='0.0.0.0', help="监听地址")
+    parser.add_argument('--port', type=int, default=5000, help="监听端口")
+    parser.add_argument('--storage', choices=sorted(STORAGE_BACKENDS), default='snapshot',
+                        help="存储模式: snapshot 内存常驻并定期写快照, wal 额外追加写日志并在后台压缩, sqlite 使用 SQLite 数据库")
+    parser.add_argument('--flush-interval', type=float, default=None,
+                        help=f"写回磁盘的时间间隔(秒), 默认 snapshot 为 {SNAPSHOT_INTERVAL}, wal 为 {WAL_COMPACT_INTERVAL}")
+    parser.add_argument('--flush-threshold', type=int, default=None,
+                        help=f"脏记录数阈值, 默认 snapshot 为 {SNAPSHOT_DIRTY_THRESHOLD}, wal 为 {WAL_COMPACT_THRESHOLD}")
+    parser.add_argument('--engine', choices=sorted(SERVER_ENGINES), default='threaded',
+                        help="服务器引擎: single 单线程, threaded 每个连接一个线程, pool 固定大小线程池")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"pool 引擎的工作线程数, 默认 {SERVER_POOL_SIZE}")
+    parser.add_argument('--history-retention-days', type=int, default=HISTORY_RETENTION_DAYS,
+                        help=f"历史记录分段的保留天数, 0 表示永久保留, 默认 {HISTORY_RETENTION_DAYS}")
+    parser.add_argument('--keyframe-interval', type=int, default=BLOB_KEYFRAME_INTERVAL,
+                        help=f"快照差异链的最大长度, 每隔这么多个快照保存一次完整内容, 默认 {BLOB_KEYFRAME_INTERVAL}")
+    parser.add_argument('--import-json', action='store_true',
+                        help="把现有的整合数据文件和历史记录导入 SQLite 数据库后退出")
+    parser.add_argument('--export-columnar', metavar='DIR',
+                        help="把状态和技能历史导出为按列保存的 .npy 文件到指定目录后退出")
+    parser.add_argument('--commit-window', type=float, default=None,
+                        help=f"wal 模式下并发写入合并为一次 fsync 的等待时间(毫秒), 默认 {GROUP_COMMIT_WINDOW * 1000:g}, 0 表示不等待")
+    parser.add_argument('--access-log-sample', action='append', type=parse_sample_rate, metavar='ROUTE=RATE',
+                        help="访问日志中某个路由成功请求的采样比例, 可以多次指定, 例如 /api/record_batch=0.01; "
+                             "默认记录接收数据接口和静态文件请求的 10%%, 其余路由全部记录, 出错的请求总是记录")
+    parser.add_argument('--pretty-json', action='store_true',
+                        help="整合数据文件等 JSON 文件使用缩进格式输出, 便于人工阅读, 默认输出紧凑格式")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    run_server()
+    args = parse_args()
+    json_codec.set_pretty(args.pretty_json)
+    if args.import_json:
+        init_consolidated_data()
+        import_into_sqlite()
+        raise SystemExit
+    if args.export_columnar:
+        init_consolidated_data()
+        store = create_store(args.storage, history_retention_days=0)
+        store.open()
+        try:
+            export_columnar(store.iter_history(), args.export_columnar)
+        finally:
+            store.close()
+        raise SystemExit
+    run_server(host=args.host, port=args.port, storage=args.storage,
+               flush_interval=args.flush_interval, flush_threshold=args.flush_threshold,
+               engine=args.engine, workers=args.workers,
+               history_retention_days=args.history_retention_days,
+               keyframe_interval=args.keyframe_interval,
+               access_log_sample_rates=dict(args.access_log_sample or ()),
+               commit_window=None if args.commit_window is None else args.commit_window / 1000)
@@ -1,4 +1,4 @@
-import json
+import json_codec
 import pandas as pd
 from tabulate import tabulate
 from recipe_analyzer import RecipeAnalyzer
@@ -9,7 +9,7 @@ def main():
     print("\n加载测试结果数据...")
     try:
         with open('taste_happiness_results.json', 'r', encoding='utf-8') as f:
-            results = json.load(f)
+            results = json_codec.load(f)
     except FileNotFoundError:
         print("未找到测试结果文件，请先运行测试")
         return
@@ -0,0 +1,93 @@
+import queue
+import logging
+import threading
+
+import json_codec
+from blob_store import diff_payload
+
+logger = logging.getLogger(__name__)
+
+def describe_changes(records, previous):
+    """生成一批记录对应的变化事件
+
+    previous(type, username) 返回该用户该类型写入前的数据内容, 没有时返回 None。
+    有旧数据时事件只携带字段差异 ops (格式同 diff_payload), 否则携带完整的 data。
+    同一批中同一用户同一类型的多条记录依次以前一条为基准。
+    """
+    latest = {}
+    changes = []
+    for record in records:
+        key = (record["type"], record["username"])
+        base = latest[key] if key in latest else previous(*key)
+        change = {"type": record["type"], "username": record["username"], "timestamp": record["timestamp"]}
+        if base is None:
+            change["data"] = record["data"]
+        else:
+            change["ops"] = diff_payload(base, record["data"])
+        latest[key] = record["data"]
+        changes.append(change)
+    return changes
+
+class Subscription:
+    """一个事件订阅者, 队列写满时标记为丢失, 由发送线程断开连接让客户端重新同步"""
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lost = False
+
+    def get(self, timeout):
+        """等待下一条事件, 超时返回 None"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventBroker:
+    """把写入产生的变化事件推送给所有订阅者
+
+    事件在存储的锁内按写入顺序发布并编号, 发布只向各订阅者的队列非阻塞地放入已序列化的文本,
+    不会因为慢客户端拖慢写入。
+    """
+
+    def __init__(self, queue_size=1000):
+        self.queue_size = queue_size
+        self.subscriptions = set()
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def close(self):
+        """结束所有订阅, 服务器停止时调用"""
+        with self.lock:
+            for subscription in self.subscriptions:
+                subscription.lost = True
+                try:
+                    subscription.queue.put_nowait(b"")
+                except queue.Full:
+                    pass
+
+    def publish(self, changes):
+        """发布一批变化, 一批写入只产生一条事件"""
+        with self.lock:
+            if not self.subscriptions:
+                return
+            self.seq += 1
+            data = json_codec.dumps({"changes": changes}, pretty=False)
+            message = f"id: {self.seq}\nevent: change\ndata: {data}\n\n".encode('utf-8')
+            for subscription in self.subscriptions:
+                try:
+                    subscription.queue.put_nowait(message)
+                except queue.Full:
+                    subscription.lost = True
@@ -0,0 +1,52 @@
+import time
+import threading
+
+class GroupCommit:
+    """把并发写入的落盘合并为一次 fsync
+
+    写入方把数据写入文件(只到操作系统缓冲区)后调用 written(seq) 登记序号, 再调用 wait(seq) 等待落盘。
+    第一个等待者成为本组的提交者: 先等待 window 秒让其他并发写入加入, 再调用 sync() 落盘,
+    sync() 开始前登记的所有序号都随这一次 fsync 完成; 提交进行中到达的写入由下一组提交。
+    单个写入最多额外等待一个时间窗口加一次 fsync 的时间。
+    """
+
+    def __init__(self, sync, window=0.002):
+        self.sync = sync
+        self.window = window
+        self.cond = threading.Condition()
+        self.written_seq = 0  # 已写入文件的最大序号
+        self.synced_seq = 0  # 已落盘的最大序号
+        self.committing = False
+        self.commits = 0  # 已执行的 fsync 组数, 用于统计
+
+    def written(self, seq):
+        with self.cond:
+            self.written_seq = max(self.written_seq, seq)
+
+    def wait(self, seq):
+        """等待序号 seq 及之前的写入落盘, 落盘失败时抛出异常"""
+        with self.cond:
+            while self.synced_seq < seq:
+                if not self.committing:
+                    self.committing = True
+                    break
+                self.cond.wait()
+            else:
+                return
+        # 成为提交者
+        try:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self.cond:
+                target = self.written_seq
+            self.sync()
+        except BaseException:
+            with self.cond:
+                self.committing = False
+                self.cond.notify_all()
+            raise
+        with self.cond:
+            self.synced_seq = max(self.synced_seq, target)
+            self.committing = False
+            self.commits += 1
+            self.cond.notify_all()
@@ -0,0 +1,315 @@
+import os
+import datetime
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+# 时间上界后缀, 使 until 为时间戳前缀(例如只给出日期)时包含该前缀下的所有记录
+UNTIL_SUFFIX = "\uffff"
+
+class TimeIndex:
+    """按时间排序的历史记录位置索引"""
+
+    def __init__(self):
+        self.timestamps = []
+        self.positions = []
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add(self, timestamp, position):
+        # 记录基本按时间顺序到达, 绝大多数情况下直接追加到末尾
+        if not self.timestamps or timestamp >= self.timestamps[-1]:
+            self.timestamps.append(timestamp)
+            self.positions.append(position)
+        else:
+            i = bisect_right(self.timestamps, timestamp)
+            self.timestamps.insert(i, timestamp)
+            self.positions.insert(i, position)
+
+    def span(self, since=None, until=None):
+        """返回时间范围 [since, until] 对应的下标区间"""
+        lo = bisect_left(self.timestamps, since) if since else 0
+        hi = bisect_right(self.timestamps, until + UNTIL_SUFFIX) if until else len(self.timestamps)
+        return lo, max(lo, hi)
+    
+    def before(self, timestamp, position):
+        """返回排在 (timestamp, position) 之前的记录数, 时间戳相同时按位置先后排序"""
+        i = bisect_left(self.timestamps, timestamp)
+        while i < len(self.timestamps) and self.timestamps[i] == timestamp and self.positions[i] < position:
+            i += 1
+        return i
+
+class HistorySegments:
+    """按天分段保存的历史记录
+
+    每条历史记录按时间戳所在日期追加到 YYYY-MM-DD.jsonl 分段文件中, 写入只会打开当天的分段,
+    时间戳晚于当天的记录(客户端时钟不准)也写入当天的分段, 不会提前打开以后日期的分段;
+    按时间范围读取时只打开与查询区间重叠的分段; 超过保留天数的分段会被整个删除。
+    内存中维护按用户、按类型以及按用户加类型的时间索引, 记录每条历史记录所在的分段和偏移,
+    查询时二分定位时间范围后直接读取命中的记录。
+    durable 为 True 时分段文件在关闭前落盘, 当天分段由调用方通过 sync() 落盘。
+    """
+
+    def __init__(self, directory, retention_days=0, durable=False):
+        self.directory = directory
+        self.retention_days = retention_days  # 0 表示永久保留
+        self.durable = durable
+        self.count = 0  # 所有分段中的记录总数
+        self.lock = threading.Lock()
+        self._current_day = None
+        self._current_file = None
+        self._reset_indexes()
+
+    def _reset_indexes(self):
+        self.index_all = TimeIndex()
+        self.index_by_user = {}
+        self.index_by_type = {}
+        self.index_by_user_type = {}
+
+    def _index_entry(self, entry, position):
+        """把一条历史记录的位置加入各个索引"""
+        timestamp = str(entry.get("timestamp", ""))
+        username = entry.get("username")
+        record_type = entry.get("type")
+        self.index_all.add(timestamp, position)
+        self.index_by_user.setdefault(username, TimeIndex()).add(timestamp, position)
+        self.index_by_type.setdefault(record_type, TimeIndex()).add(timestamp, position)
+        self.index_by_user_type.setdefault((username, record_type), TimeIndex()).add(timestamp, position)
+
+    def _segment_path(self, day):
+        return os.path.join(self.directory, f"{day}.jsonl")
+
+    def list_days(self):
+        """按日期顺序列出所有分段"""
+        days = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".jsonl"):
+                day = filename[:-len(".jsonl")]
+                try:
+                    datetime.date.fromisoformat(day)
+                except ValueError:
+                    continue
+                days.append(day)
+        return sorted(days)
+
+    @staticmethod
+    def segment_day(entry):
+        """历史记录所属的分段日期, 时间戳无法解析或晚于当天时归入当天"""
+        today = datetime.date.today().isoformat()
+        day = str(entry.get("timestamp", ""))[:10]
+        try:
+            datetime.date.fromisoformat(day)
+        except ValueError:
+            return today
+        return min(day, today)
+
+    def _scan_segment(self, day):
+        """依次返回分段中每条记录的偏移和内容"""
+        with open(self._segment_path(day), 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    try:
+                        yield offset, json_codec.loads(line)
+                    except json_codec.JSONDecodeError:
+                        # 崩溃时最后一行可能只写了一半
+                        logger.warning(f"跳过损坏的历史记录: {self._segment_path(day)}@{offset}")
+                offset += len(line)
+
+    def open(self):
+        """删除过期分段并建立索引"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune()
+
+        days = self.list_days()
+        self.count = 0
+        self._reset_indexes()
+        for day in days:
+            for offset, entry in self._scan_segment(day):
+                self._index_entry(entry, (day, offset))
+                self.count += 1
+        logger.info(f"已加载历史记录分段: {len(days)} 个分段, 共 {self.count} 条记录")
+
+    def _file_for(self, day):
+        """返回分段的写入文件, 当天的分段保持打开"""
+        if day == self._current_day:
+            return self._current_file, False
+        if self._current_day is None or day > self._current_day:
+            if self._current_file:
+                self._close_file(self._current_file)
+            self._current_day = day
+            self._current_file = open(self._segment_path(day), 'ab')
+            return self._current_file, False
+        # 迟到的旧记录, 临时打开对应的旧分段
+        return open(self._segment_path(day), 'ab'), True
+
+    def append(self, entries):
+        """追加多条历史记录并更新索引"""
+        by_day = {}
+        for entry in entries:
+            by_day.setdefault(self.segment_day(entry), []).append(entry)
+
+        with self.lock:
+            for day in sorted(by_day):
+                f, temporary = self._file_for(day)
+                try:
+                    offset = f.tell()
+                    chunks = []
+                    for entry in by_day[day]:
+                        line = json_codec.dumpb(entry, pretty=False) + b"\n"
+                        self._index_entry(entry, (day, offset))
+                        chunks.append(line)
+                        offset += len(line)
+                    f.write(b"".join(chunks))
+                    f.flush()
+                finally:
+                    if temporary:
+                        self._close_file(f)
+            self.count += len(entries)
+
+    def _close_file(self, f):
+        if self.durable:
+            os.fsync(f.fileno())
+        f.close()
+
+    def sync(self):
+        """把当天分段已写入的记录落盘, fsync 期间不阻塞其他写入"""
+        with self.lock:
+            if self._current_file is None:
+                return
+            fd = os.dup(self._current_file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def read(self, since=None, until=None):
+        """逐个分段读取 [since, until] 范围内的历史记录
+
+        分段中记录的时间戳不早于分段日期, 但可能晚于分段日期, 因此只跳过晚于 until 的分段。
+        """
+        for day in self.list_days():
+            if until and day > until[:10]:
+                break
+            for _, entry in self._scan_segment(day):
+                timestamp = str(entry.get("timestamp", ""))
+                if since and timestamp < since:
+                    continue
+                if until and timestamp > until + UNTIL_SUFFIX:
+                    continue
+                yield entry
+
+    def query(self, username=None, record_type=None, since=None, until=None, limit=None):
+        """通过索引查询历史记录
+
+        返回 (命中总数, 记录列表)。记录按时间升序排列, 命中数超过 limit 时只返回最新的 limit 条。
+        """
+        with self.lock:
+            if username is not None and record_type is not None:
+                index = self.index_by_user_type.get((username, record_type))
+            elif username is not None:
+                index = self.index_by_user.get(username)
+            elif record_type is not None:
+                index = self.index_by_type.get(record_type)
+            else:
+                index = self.index_all
+            if not index:
+                return 0, []
+            lo, hi = index.span(since, until)
+            total = hi - lo
+            if limit is not None and total > limit:
+                lo = hi - limit
+            positions = index.positions[lo:hi]
+        return total, self._read_positions(positions)
+
+    def page(self, usernames=None, cursor=None, limit=100):
+        """从新到旧分页读取历史记录
+        
+        返回游标之前最新的 limit 条记录(按时间升序)以及下一页的游标, 没有更早的记录时游标为 None。
+        游标是上一页最早一条记录的 (时间戳, 位置), 新写入的记录不会影响已有游标的位置。
+        usernames 给出时只返回这些用户的记录。
+        """
+        with self.lock:
+            if usernames is None:
+                indexes = [self.index_all]
+            else:
+                indexes = [self.index_by_user[username] for username in usernames if username in self.index_by_user]
+            candidates = []
+            more = False
+            for index in indexes:
+                hi = index.before(*cursor) if cursor else len(index)
+                lo = max(0, hi - limit)
+                more = more or lo > 0
+                candidates.extend(zip(index.timestamps[lo:hi], index.positions[lo:hi]))
+        candidates.sort()
+        if len(candidates) > limit:
+            candidates = candidates[len(candidates) - limit:]
+            more = True
+        next_cursor = candidates[0] if more and candidates else None
+        return self._read_positions([position for _, position in candidates]), next_cursor
+    
+    def _read_positions(self, positions):
+        """按位置读取记录, 每个分段只打开一次"""
+        entries = []
+        handles = {}
+        try:
+            for day, offset in positions:
+                if day not in handles:
+                    try:
+                        handles[day] = open(self._segment_path(day), 'rb')
+                    except FileNotFoundError:
+                        # 分段可能刚好因过期被删除
+                        handles[day] = None
+                f = handles[day]
+                if f is None:
+                    continue
+                f.seek(offset)
+                entries.append(json_codec.loads(f.readline()))
+        finally:
+            for f in handles.values():
+                if f:
+                    f.close()
+        return entries
+
+    def prune(self, today=None):
+        """删除超过保留天数的分段, 返回删除的分段数"""
+        if self.retention_days <= 0:
+            return 0
+        today = today or datetime.date.today()
+        cutoff = (today - datetime.timedelta(days=self.retention_days)).isoformat()
+        with self.lock:
+            removed_days = set()
+            for day in self.list_days():
+                if day >= cutoff:
+                    break
+                if day == self._current_day:
+                    continue
+                path = self._segment_path(day)
+                os.remove(path)
+                removed_days.add(day)
+                logger.info(f"已删除过期的历史记录分段: {path}")
+            if removed_days:
+                self._drop_days(removed_days)
+        return len(removed_days)
+
+    def _drop_days(self, removed_days):
+        """从索引中移除已删除分段中的记录"""
+        for index in [self.index_all, *self.index_by_user.values(), *self.index_by_type.values(),
+                      *self.index_by_user_type.values()]:
+            kept = [(timestamp, position) for timestamp, position in zip(index.timestamps, index.positions)
+                    if position[0] not in removed_days]
+            index.timestamps = [timestamp for timestamp, _ in kept]
+            index.positions = [position for _, position in kept]
+        self.count = len(self.index_all)
+
+    def close(self):
+        with self.lock:
+            if self._current_file:
+                self._close_file(self._current_file)
+                self._current_file = None
+                self._current_day = None
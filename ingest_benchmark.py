@@ -0,0 +1,341 @@
+import os
+import sys
+import time
+import gzip
+import shlex
+import random
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+import http.client
+
+import json_codec
+from codec_benchmark import sample_userdetail
+from metrics import directory_size
+
+# 测试结果默认保存目录
+RESULTS_DIR = "benchmark_results"
+# 延迟分位数
+PERCENTILES = (50, 95, 99)
+
+SKILL_NAMES = ["烹饪", "采集", "伐木", "挖矿", "纺织", "锻造", "木工", "医术", "种植", "畜牧"]
+
+def sample_status(rng):
+    """生成一份与 /get_status/ 返回结构相同的状态数据"""
+    return {
+        "today": {
+            "stamina": rng.randint(0, 100),
+            "health": rng.randint(0, 100),
+            "happiness": rng.randint(0, 100),
+            "starvation": rng.randint(0, 100),
+            "strength": rng.randint(1, 50),
+            "intelligence": rng.randint(1, 50),
+        },
+        "tomorrow": {
+            "stamina_change": rng.randint(-20, 20),
+            "health_change": rng.randint(-10, 10),
+            "happiness_change": rng.randint(-10, 10),
+            "starvation_change": rng.randint(-20, 0),
+        },
+    }
+
+def sample_skill(rng):
+    """生成一份与 /get_skill/ 返回结构相同的技能数据"""
+    datalist = []
+    for skill_id, name in enumerate(SKILL_NAMES, 1):
+        datalist.append({
+            "id": skill_id,
+            "name": name,
+            "level": f"{rng.randint(1, 9)}级",
+            "level_num": rng.randint(1, 9),
+            "skill_num": round(rng.uniform(0, 1000), 2),
+            "comprehension": round(rng.uniform(0, 10), 2),
+            "eureka_chance": round(rng.uniform(0, 1), 4),
+            "skill_mini": [{"small_skill": f"{name}{i}", "skill_num": round(rng.uniform(0, 100), 2)} for i in range(3)],
+        })
+    return {"datalist": datalist, "sideline_times": rng.randint(0, 5)}
+
+def page_load_records(user, rng):
+    """模拟油猴脚本一次页面加载提交的用户详细信息、状态和技能三条记录"""
+    username = f"user{user:04d}"
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+    userdetail = sample_userdetail(user)
+    userdetail["timestamp"] = timestamp
+    return [
+        userdetail,
+        {"type": "status", "username": username, "timestamp": timestamp, "data": sample_status(rng)},
+        {"type": "skill", "username": username, "timestamp": timestamp, "data": sample_skill(rng)},
+    ]
+
+def build_requests(records, mode):
+    """把一次页面加载的记录转换为 (路径, 请求体, 请求头) 列表
+
+    batch 模式与油猴脚本相同, gzip 压缩后一次提交到 /api/record_batch;
+    single 模式每条记录单独提交到 /api/record_<type>, 可用于只支持单条接口的服务器。
+    """
+    if mode == "batch":
+        body = gzip.compress(json_codec.dumpb({"records": records}, pretty=False))
+        return [("/api/record_batch", body, {"Content-Type": "application/json", "Content-Encoding": "gzip"})]
+    return [(f"/api/record_{record['type']}", json_codec.dumpb(record, pretty=False), {"Content-Type": "application/json"})
+            for record in records]
+
+def percentile(sorted_values, p):
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+class LoadGenerator:
+    """按固定速率向服务器提交模拟数据
+
+    每秒 rate 次页面加载按计划时间均匀分配给 concurrency 个工作线程, 每个线程使用一个长连接。
+    延迟从计划发送时间开始计算, 服务器变慢导致请求排队时, 排队时间也计入延迟, 不会因为发送变慢而低估。
+    data_dir 给出时每隔 sample_interval 秒记录一次数据目录的大小。
+    """
+
+    def __init__(self, host, port, users, rate, duration, concurrency, mode, data_dir=None, sample_interval=1.0, timeout=30):
+        self.host = host
+        self.port = port
+        self.users = users
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.mode = mode
+        self.data_dir = data_dir
+        self.sample_interval = sample_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.latencies = []
+        self.requests = 0
+        self.records = 0
+        self.errors = 0
+        self.error_samples = {}
+        self.bytes_sent = 0
+        self.disk_samples = []
+        self._stop = threading.Event()
+
+    def _next_slot(self):
+        with self.lock:
+            index = self.next_index
+            self.next_index += 1
+        scheduled = self.started + index / self.rate
+        if scheduled - self.started >= self.duration:
+            return None
+        return index, scheduled
+
+    def _record_error(self, message):
+        with self.lock:
+            self.errors += 1
+            self.error_samples[message] = self.error_samples.get(message, 0) + 1
+
+    def _worker(self, worker_id):
+        rng = random.Random(worker_id)
+        conn = None
+        while True:
+            slot = self._next_slot()
+            if slot is None:
+                break
+            index, scheduled = slot
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            records = page_load_records(index % self.users, rng)
+            begin = scheduled
+            for path, body, headers in build_requests(records, self.mode):
+                try:
+                    if conn is None:
+                        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                    conn.request("POST", path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    ok = response.status == 200
+                    if not ok:
+                        self._record_error(f"HTTP {response.status}")
+                    if response.getheader("Connection", "").lower() == "close":
+                        conn.close()
+                        conn = None
+                except (OSError, http.client.HTTPException) as e:
+                    ok = False
+                    self._record_error(type(e).__name__)
+                    if conn is not None:
+                        conn.close()
+                    conn = None
+                end = time.perf_counter()
+                latency = end - begin
+                begin = end  # single 模式下同一次页面加载的后续请求从上一个请求结束时开始计时
+                with self.lock:
+                    self.requests += 1
+                    self.bytes_sent += len(body)
+                    if ok:
+                        self.records += len(records) if self.mode == "batch" else 1
+                        self.latencies.append(latency)
+        if conn is not None:
+            conn.close()
+
+    def _sample_disk(self):
+        """定期记录数据目录的大小"""
+        while True:
+            elapsed = time.perf_counter() - self.started
+            self.disk_samples.append({"elapsed": round(elapsed, 3), "bytes": directory_size(self.data_dir)})
+            if self._stop.wait(self.sample_interval):
+                break
+        elapsed = time.perf_counter() - self.started
+        self.disk_samples.append({"elapsed": round(elapsed, 3), "bytes": directory_size(self.data_dir)})
+
+    def run(self):
+        self.started = time.perf_counter()
+        sampler = None
+        if self.data_dir:
+            sampler = threading.Thread(target=self._sample_disk, daemon=True)
+            sampler.start()
+        workers = [threading.Thread(target=self._worker, args=(i,), daemon=True) for i in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - self.started
+        self._stop.set()
+        if sampler:
+            sampler.join()
+        return self.summary(elapsed)
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        result = {
+            "elapsed": round(elapsed, 3),
+            "requests": self.requests,
+            "records": self.records,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 6) if self.requests else 0,
+            "error_samples": self.error_samples,
+            "requests_per_second": round(self.requests / elapsed, 2),
+            "records_per_second": round(self.records / elapsed, 2),
+            "bytes_sent": self.bytes_sent,
+            "latency_ms": {f"p{p}": round(percentile(latencies, p) * 1000, 2) if latencies else None for p in PERCENTILES},
+        }
+        result["latency_ms"]["max"] = round(latencies[-1] * 1000, 2) if latencies else None
+        if self.disk_samples:
+            start, end = self.disk_samples[0], self.disk_samples[-1]
+            result["disk"] = {
+                "start_bytes": start["bytes"],
+                "end_bytes": end["bytes"],
+                "growth_bytes": end["bytes"] - start["bytes"],
+                "bytes_per_record": round((end["bytes"] - start["bytes"]) / self.records, 1) if self.records else None,
+                "samples": self.disk_samples,
+            }
+        return result
+
+def wait_for_server(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request("GET", "/api/stats")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError(f"服务器在 {timeout} 秒内没有启动: {host}:{port}")
+
+def spawn_server(port, server_args):
+    """在临时目录中启动一个 consolidated_data_server.py 实例, 返回 (进程, 数据目录)"""
+    workdir = tempfile.mkdtemp(prefix="civitas_bench_")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "consolidated_data_server.py")
+    log = open(os.path.join(workdir, "server.log"), 'w', encoding='utf-8')
+    process = subprocess.Popen([sys.executable, script, "--host", "127.0.0.1", "--port", str(port)] + server_args,
+                               cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    return process, os.path.join(workdir, "civitas_data")
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def print_result(result):
+    print(f"请求数: {result['requests']}  记录数: {result['records']}  耗时: {result['elapsed']} 秒")
+    print(f"吞吐量: {result['requests_per_second']} 请求/秒, {result['records_per_second']} 记录/秒")
+    latency = result["latency_ms"]
+    print("延迟(ms): " + "  ".join(f"{name} {value}" for name, value in latency.items()))
+    print(f"错误: {result['errors']} ({result['error_rate']:.2%})")
+    for message, count in result["error_samples"].items():
+        print(f"  {message}: {count}")
+    disk = result.get("disk")
+    if disk:
+        print(f"磁盘增长: {disk['growth_bytes'] / 1024:.1f} KB ({disk['bytes_per_record']} 字节/记录)")
+
+def compare_results(previous, current):
+    """与之前保存的结果对比主要指标"""
+    print(f"\n与 {previous.get('revision') or '之前的结果'} ({previous.get('started')}) 对比:")
+    rows = [("记录/秒", ("records_per_second",)), ("错误率", ("error_rate",))]
+    rows += [(f"{name} 延迟(ms)", ("latency_ms", name)) for name in current["latency_ms"]]
+    rows.append(("字节/记录", ("disk", "bytes_per_record")))
+    for label, keys in rows:
+        before, after = previous, current
+        for key in keys:
+            before = (before or {}).get(key)
+            after = (after or {}).get(key)
+        if before is None or after is None:
+            continue
+        change = f"{(after - before) / before:+.1%}" if before else ""
+        print(f"  {label}: {before} -> {after} {change}")
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟多个油猴脚本向整合数据服务器提交数据的压力测试")
+    parser.add_argument('--host', default='127.0.0.1', help="服务器地址")
+    parser.add_argument('--port', type=int, default=5000, help="服务器端口")
+    parser.add_argument('--users', type=int, default=100, help="模拟的用户数, 默认 100")
+    parser.add_argument('--rate', type=float, default=50, help="每秒页面加载次数(每次提交三条记录), 默认 50")
+    parser.add_argument('--duration', type=float, default=30, help="测试时长(秒), 默认 30")
+    parser.add_argument('--concurrency', type=int, default=16, help="并发连接数, 默认 16")
+    parser.add_argument('--mode', choices=('batch', 'single'), default='batch',
+                        help="batch 与油猴脚本相同使用 /api/record_batch, single 每条记录单独提交")
+    parser.add_argument('--data-dir', help="统计磁盘增长的数据目录, 使用 --spawn 时自动设置")
+    parser.add_argument('--sample-interval', type=float, default=1.0, help="磁盘大小的采样间隔(秒)")
+    parser.add_argument('--spawn', action='store_true', help="在临时目录中启动一个服务器实例进行测试")
+    parser.add_argument('--server-args', default='', help="--spawn 时传给服务器的参数, 例如 \"--storage wal\"")
+    parser.add_argument('--output', help=f"结果保存路径, 默认保存到 {RESULTS_DIR}/ 下")
+    parser.add_argument('--compare', help="与之前保存的结果文件对比")
+    args = parser.parse_args()
+
+    process = None
+    data_dir = args.data_dir
+    if args.spawn:
+        process, data_dir = spawn_server(args.port, shlex.split(args.server_args))
+        print(f"已启动测试服务器, 数据目录: {data_dir}")
+    try:
+        wait_for_server(args.host, args.port)
+        generator = LoadGenerator(args.host, args.port, args.users, args.rate, args.duration, args.concurrency,
+                                  args.mode, data_dir=data_dir, sample_interval=args.sample_interval)
+        started = datetime.datetime.now().isoformat()
+        result = generator.run()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=60)
+
+    result = dict({
+        "started": started,
+        "revision": git_revision(),
+        "parameters": {key: getattr(args, key) for key in
+                       ("users", "rate", "duration", "concurrency", "mode", "spawn", "server_args")},
+    }, **result)
+    print_result(result)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json_codec.load(f), result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"ingest_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json_codec.dump(result, f, pretty=True)
+    print(f"\n测试结果已保存到 {output}")
+
+if __name__ == '__main__':
+    main()
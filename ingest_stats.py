@@ -0,0 +1,87 @@
+import time
+
+# 写入速率的统计窗口(秒)
+RATE_WINDOWS = {"1m": 60, "5m": 300, "1h": 3600}
+
+class SlidingWindowCounter:
+    """按秒分桶的环形计数器, 统计最近一段时间内的写入条数"""
+
+    def __init__(self, span=3600):
+        self.span = span
+        self.seconds = [0] * span
+        self.counts = [0] * span
+
+    def add(self, count, now):
+        second = int(now)
+        i = second % self.span
+        if self.seconds[i] != second:
+            # 这个桶上一次使用是在一个周期之前, 重新计数
+            self.seconds[i] = second
+            self.counts[i] = 0
+        self.counts[i] += count
+
+    def total(self, window, now):
+        """最近 window 秒内的计数, 与已记录的数据量无关, 最多扫描 span 个桶"""
+        second = int(now)
+        return sum(count for bucket, count in zip(self.seconds, self.counts) if second - window < bucket <= second)
+
+class IngestStats:
+    """在写入时增量维护的统计信息
+
+    记录每种类型有数据的用户集合、全部用户集合、每个用户最后一条记录的时间戳,
+    以及最近 1 分钟、5 分钟、1 小时的写入条数, 使 /api/stats 不需要遍历数据。
+    需在存储的锁内调用。
+    """
+
+    def __init__(self, record_types):
+        self.users_by_type = {record_type: set() for record_type in record_types}
+        self.users = set()
+        self.last_seen = {}
+        self.rate = SlidingWindowCounter(max(RATE_WINDOWS.values()))
+        self.started = time.time()
+
+    def load(self, record_type, username, timestamp):
+        """启动时加载已有的最新数据"""
+        self.users_by_type[record_type].add(username)
+        self.users.add(username)
+        self._see(username, timestamp)
+
+    def record(self, records, now=None):
+        """统计一批新写入的记录"""
+        for record in records:
+            self.users_by_type[record["type"]].add(record["username"])
+            self.users.add(record["username"])
+            self._see(record["username"], record["timestamp"])
+        self.rate.add(len(records), now or time.time())
+
+    def _see(self, username, timestamp):
+        # 迟到或乱序的记录不会让最后记录时间倒退
+        if str(timestamp) > str(self.last_seen.get(username, "")):
+            self.last_seen[username] = timestamp
+
+    def ingest_rate(self, now=None):
+        now = now or time.time()
+        rates = {}
+        for name, window in RATE_WINDOWS.items():
+            count = self.rate.total(window, now)
+            # 刚启动时按实际运行时间计算速率
+            elapsed = min(window, max(now - self.started, 1))
+            rates[name] = {"records": count, "per_second": round(count / elapsed, 3)}
+        return rates
+
+    def summary(self, history_counts, last_updated):
+        """/api/stats 返回的统计信息, history_counts 为每种类型的历史记录条数"""
+        summary = {
+            "total_users": len(self.users),
+            "users": list(self.users),
+        }
+        for record_type, users in self.users_by_type.items():
+            summary[f"{record_type}_records"] = len(users)
+        summary.update({
+            "history_records": sum(history_counts.values()),
+            "history_by_type": history_counts,
+            "last_updated": last_updated,
+            "last_seen": dict(self.last_seen),
+            "ingest_rate": self.ingest_rate(),
+        })
+        return summary
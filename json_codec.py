@@ -0,0 +1,63 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 安装了 orjson 时使用 orjson 编解码, 否则使用标准库
+BACKEND = "orjson" if orjson else "json"
+
+# 默认输出紧凑格式, 需要人工阅读的文件可以打开缩进输出
+PRETTY = False
+
+JSONDecodeError = json.JSONDecodeError  # orjson.JSONDecodeError 也是它的子类
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+def set_pretty(pretty):
+    """设置 dump/dumps 默认是否输出缩进格式"""
+    global PRETTY
+    PRETTY = bool(pretty)
+
+def dumpb(obj, pretty=None, sort_keys=False):
+    """把对象编码为 UTF-8 字节串, 默认使用紧凑分隔符且不转义非 ASCII 字符"""
+    if pretty is None:
+        pretty = PRETTY
+    if orjson is not None:
+        options = _ORJSON_OPTIONS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        if sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=options)
+        except orjson.JSONEncodeError:
+            # orjson 不支持的值(例如超过 64 位的整数)交给标准库处理
+            pass
+    return _stdlib_dumps(obj, pretty, sort_keys).encode('utf-8')
+
+def dumps(obj, pretty=None, sort_keys=False):
+    """把对象编码为字符串"""
+    if orjson is not None:
+        return dumpb(obj, pretty, sort_keys).decode('utf-8')
+    return _stdlib_dumps(obj, PRETTY if pretty is None else pretty, sort_keys)
+
+def _stdlib_dumps(obj, pretty, sort_keys):
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=sort_keys)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys)
+
+def loads(data):
+    """解码字符串或字节串"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dump(obj, f, pretty=None):
+    """写入以文本模式打开的文件"""
+    f.write(dumps(obj, pretty))
+
+def load(f):
+    """读取文本或二进制模式打开的文件"""
+    return loads(f.read())
@@ -0,0 +1,302 @@
+import os
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Prometheus 文本格式的内容类型
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 延迟直方图的默认分桶上界(秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric(ABC):
+    """带标签的指标"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self):
+        """返回 (后缀, 标签值, 额外标签, 数值) 列表"""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return lines
+
+class _LabeledMetric(Metric):
+    """由程序更新的指标, 每组标签值对应一个子指标"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """创建一组标签值对应的子指标"""
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class Counter(_LabeledMetric):
+    """只增不减的计数, 名称按惯例以 _total 结尾"""
+
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        return [("", values, (), child.value) for values, child in list(self.children.items())]
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶对应 +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+class Histogram(_LabeledMetric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        samples = []
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(("_bucket", values, (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", values, (), total))
+            samples.append(("_count", values, (), cumulative))
+        return samples
+
+class Gauge(Metric):
+    """抓取时由回调函数计算的指标, 回调返回 {标签值元组: 数值}"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self):
+        return [("", tuple(str(value) for value in values), (), value) for values, value in self.callback().items()]
+
+class Registry:
+    """一组指标, render() 输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+def directory_size(path):
+    """目录下所有文件的总字节数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def route_label(path, routes):
+    """把请求路径归并为有限的路由标签
+
+    routes 中以 / 结尾的项(根路径除外)按前缀匹配, 例如 /api/get_record/ 匹配所有记录文件名;
+    其余项按完整路径匹配, 都不匹配时归为 other, 避免任意路径产生无限多的标签组合。
+    """
+    path = path.split('?', 1)[0]
+    for route in routes:
+        if path == route or (route != '/' and route.endswith('/') and path.startswith(route)):
+            return route
+    return "other"
+
+class HttpMetrics:
+    """HTTP 服务器的请求数、延迟直方图和收发字节数"""
+
+    def __init__(self, registry, routes=()):
+        self.registry = registry
+        self.routes = routes
+        self.requests = registry.counter("civitas_http_requests_total", "按路由和状态码统计的请求数",
+                                         ("method", "route", "status"))
+        self.latency = registry.histogram("civitas_http_request_duration_seconds", "按路由统计的请求处理耗时",
+                                          ("method", "route"))
+        self.bytes_in = registry.counter("civitas_http_request_bytes_total", "按路由统计的请求体字节数", ("route",))
+        self.bytes_out = registry.counter("civitas_http_response_bytes_total", "按路由统计的响应字节数", ("route",))
+
+    def observe(self, method, route, status, seconds, bytes_in, bytes_out):
+        self.requests.labels(method, route, status).inc()
+        self.latency.labels(method, route).observe(seconds)
+        if bytes_in:
+            self.bytes_in.labels(route).inc(bytes_in)
+        if bytes_out:
+            self.bytes_out.labels(route).inc(bytes_out)
+
+class CountingWriter:
+    """统计写出字节数的输出流包装"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class InstrumentedHandlerMixin:
+    """为 BaseHTTPRequestHandler 记录每个请求的指标和访问日志, 需放在基类之前
+
+    服务器对象带有 metrics 属性(HttpMetrics)时记录指标, 带有 access_log 属性(request_log.AccessLog)时
+    记录访问日志并不再由 BaseHTTPRequestHandler 逐个请求同步写 stderr。计时从读到请求行开始,
+    不包括长连接上等待下一个请求的空闲时间; 请求字节数按 Content-Length 统计, 响应字节数包括响应头。
+    """
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def parse_request(self):
+        started = time.perf_counter()
+        self._response_status = None
+        self._bytes_before = self.wfile.bytes
+        if not super().parse_request():
+            return False
+        self._request_started = started
+        return True
+
+    def send_response(self, code, message=None):
+        self._response_status = code
+        super().send_response(code, message)
+
+    def log_request(self, code='-', size='-'):
+        if getattr(self.server, "access_log", None) is None:
+            super().log_request(code, size)
+
+    def log_message(self, format, *args):
+        if getattr(self.server, "access_log", None) is None:
+            super().log_message(format, *args)
+        else:
+            # 请求超时、请求行不合法等由基类报告的问题
+            logging.getLogger(__name__).warning(f"{self.address_string()} - {format % args}")
+
+    def handle_one_request(self):
+        self._request_started = None
+        try:
+            super().handle_one_request()
+        finally:
+            # 请求行或请求头不合法的请求不计入
+            if self._request_started is not None and self._response_status is not None:
+                self._observe_request()
+
+    def _observe_request(self):
+        metrics = getattr(self.server, "metrics", None)
+        access_log = getattr(self.server, "access_log", None)
+        if metrics is None and access_log is None:
+            return
+        seconds = time.perf_counter() - self._request_started
+        try:
+            bytes_in = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            bytes_in = 0
+        bytes_out = self.wfile.bytes - self._bytes_before
+        route = route_label(self.path, metrics.routes if metrics is not None else ())
+        if metrics is not None:
+            metrics.observe(self.command, route, self._response_status, seconds, bytes_in, bytes_out)
+        if access_log is not None:
+            access_log.log(self.command, route, self.path, self._response_status, seconds, bytes_in, bytes_out,
+                           self.client_address[0])
@@ -1,5 +1,6 @@
 import requests
 import json
+import json_codec
 import time
 import urllib3
 from tabulate import tabulate
@@ -60,7 +61,7 @@ class RecipeAnalyzer:
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         filename = f'raw_ingredients_{timestamp}.json'
         with open(os.path.join(self.data_dir, filename), 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            json_codec.dump(data, f)
         print(f"已保存原始数据到 {filename}")
         
         # 打印原始JSON到控制台
@@ -115,7 +116,7 @@ class RecipeAnalyzer:
         """验证原始食材数据与表格数据的匹配性"""
         try:
             with open('raw_ingredients.json', 'r', encoding='utf-8') as f:
-                raw_data = json.load(f)
+                raw_data = json_codec.load(f)
             
             raw_ingredients = raw_data['data']['datalist']
             raw_properties = raw_data['data']['datadict']
@@ -295,7 +296,7 @@ class RecipeAnalyzer:
         # 保存到文件
         filepath = os.path.join(self.data_dir, filename)
         with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(full_data, f, ensure_ascii=False, indent=2)
+            json_codec.dump(full_data, f)
         
         print(f"\n分析结果已保存到: {filename}")
         return filepath
@@ -0,0 +1,544 @@
+import os
+import gzip
+import datetime
+import logging
+import hashlib
+import argparse
+import threading
+from urllib.parse import unquote
+from bisect import insort, bisect_right
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+RECORD_TYPES = ("status", "skill")
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"  # 文件名中时间戳的格式
+TIMESTAMP_LENGTH = 19  # 文件名中时间戳的长度
+LATEST_SUFFIX = "_latest.json"  # 每个用户最新数据文件的后缀
+INDEX_FILE = "records_index.jsonl"  # 数据目录中保存记录元数据的索引文件
+SHARD_PREFIX_LENGTH = 2  # 用户名哈希前缀的十六进制位数, 每种类型下最多 256 个分片目录
+BUNDLE_SUFFIX = ".jsonl.gz"  # 一天的记录合并后的压缩包后缀, 与日期目录同名
+BUNDLE_INDEX_SUFFIX = ".idx.json"  # 压缩包偏移索引的后缀
+BUNDLE_BLOCK_SIZE = 64 * 1024  # 压缩包中每个独立压缩块的未压缩大小上限(字节)
+BUNDLE_INDEX_CACHE_SIZE = 1024  # 内存中缓存的压缩包索引个数
+# 不能出现在文件名中的字符和转义用的 %, 写入文件名时编码为 %XX
+UNSAFE_FILENAME_CHARS = frozenset('/\\:*?"<>|\0%')
+EMPTY_FILENAME_PART = "%"  # 空用户名在文件名中的形式, 其他用户名编码后不会出现单独的 %
+
+def filename_part(username):
+    """把用户名转换为可以安全用作文件名一部分的字符串, 真实的用户名保存在索引文件中
+
+    不安全的字符和控制字符按 URL 编码写为 %XX, 只由 . 组成的用户名编码全部的 .,
+    不同的用户名得到不同的结果, 可以用 username_from_filename_part 还原。
+    """
+    text = str(username)
+    if not text:
+        return EMPTY_FILENAME_PART
+    if not text.strip('.'):
+        return "%2E" * len(text)
+    return "".join(f"%{ord(c):02X}" if c in UNSAFE_FILENAME_CHARS or c < ' ' else c for c in text)
+
+def username_from_filename_part(name_part):
+    """filename_part 的逆变换"""
+    return "" if name_part == EMPTY_FILENAME_PART else unquote(name_part)
+
+def record_filename(record_type, username, timestamp):
+    return f"{record_type}_{filename_part(username)}_{timestamp}.json"
+
+def latest_filename(record_type, username):
+    return f"{record_type}_{filename_part(username)}{LATEST_SUFFIX}"
+
+def parse_record_filename(filename):
+    """从 类型_用户名_时间戳.json 形式的文件名解析出 (类型, 用户名, 时间戳), 不是记录文件时返回 None
+
+    用户名可能包含下划线, 因此时间戳按固定长度从末尾截取, 类型取第一个下划线之前的部分。
+    文件名中的用户名经过 filename_part 转换, 真实的用户名以索引文件或记录内容为准。
+    """
+    if not filename.endswith(".json") or filename.endswith(LATEST_SUFFIX):
+        return None
+    stem = filename[:-len(".json")]
+    record_type, sep, rest = stem.partition('_')
+    if record_type not in RECORD_TYPES or not sep or len(rest) < TIMESTAMP_LENGTH + 2:
+        return None
+    username, sep, timestamp = rest[:-TIMESTAMP_LENGTH - 1], rest[-TIMESTAMP_LENGTH - 1], rest[-TIMESTAMP_LENGTH:]
+    if sep != '_':
+        return None
+    try:
+        datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    return record_type, username, timestamp
+
+def parse_latest_filename(filename):
+    """从 类型_用户名_latest.json 形式的文件名解析出 (类型, 用户名), 不是最新数据文件时返回 None"""
+    if not filename.endswith(LATEST_SUFFIX):
+        return None
+    record_type, sep, username = filename[:-len(LATEST_SUFFIX)].partition('_')
+    if record_type not in RECORD_TYPES or not sep or not username:
+        return None
+    return record_type, username
+
+def user_directory(record_type, name_part):
+    """用户的分片目录 类型/用户名哈希前缀/用户名, name_part 为文件名中的用户名
+
+    哈希按文件名中的用户名计算, 因此只凭文件名就能找到文件所在的目录。
+    """
+    prefix = hashlib.md5(name_part.encode('utf-8')).hexdigest()[:SHARD_PREFIX_LENGTH]
+    return os.path.join(record_type, prefix, name_part)
+
+def record_path(filename):
+    """记录文件或最新数据文件在分片目录中的相对路径, 其他文件返回 None
+
+    记录文件保存在 类型/哈希前缀/用户名/YYYY-MM-DD/ 下, 最新数据文件保存在 类型/哈希前缀/用户名/ 下。
+    """
+    parsed = parse_record_filename(filename)
+    if parsed is not None:
+        record_type, name_part, timestamp = parsed
+        return os.path.join(user_directory(record_type, name_part), timestamp[:10], filename)
+    parsed = parse_latest_filename(filename)
+    if parsed is not None:
+        return os.path.join(user_directory(*parsed), filename)
+    return None
+
+class RecordFiles:
+    """每条记录一个 JSON 文件的数据目录
+
+    每次写入保存一个 类型_用户名_时间戳.json 历史记录文件, 并覆盖该用户该类型的 _latest.json 文件,
+    文件按 record_path 保存在分片目录中, 避免单个目录中的文件过多; 旧版本平铺在数据目录下的文件仍然可以读取,
+    可以用 migrate() 移动到分片目录中。已经结束的日期目录可以用 compact() 合并为压缩包。
+    记录的元数据(文件名、类型、用户名、时间戳、大小)同时追加到数据目录中的索引文件,
+    启动时读取索引文件建立内存索引而不扫描目录, 索引文件不存在时从记录文件重建。
+    内存索引按 (时间戳, 文件名) 排序, 分别维护全部记录、按类型、按用户和按用户加类型的有序列表,
+    筛选和分页只需对命中的列表切片, 统计信息直接取各列表的长度。时间戳为服务器收到记录的时间。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.index_file = None
+        self.sizes = {}  # 文件名 -> 文件大小
+        self.lists = {}  # (类型或 None, 用户名或 None) -> 按 (时间戳, 文件名, 类型, 用户名) 排序的列表
+        self.made_dirs = set()  # 已经创建的分片目录
+        self.bundle_indexes = {}  # 日期目录 -> (索引文件修改时间, 压缩包索引)
+
+    def load(self):
+        """读取索引文件建立内存索引, 索引文件不存在时从记录文件重建"""
+        if not os.path.exists(self.index_path):
+            logger.info(f"索引文件 {self.index_path} 不存在, 从记录文件重建")
+            self.rebuild()
+        entries = {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json_codec.loads(line)
+                except json_codec.JSONDecodeError:
+                    # 写入中途崩溃时最后一行可能不完整
+                    logger.warning(f"跳过索引文件第 {line_number} 行无法解析的内容")
+                    continue
+                entries[entry["filename"]] = entry
+        self._replace(entries.values())
+        with self.lock:
+            if self.index_file is None:
+                self.index_file = open(self.index_path, 'a', encoding='utf-8')
+            self.loaded = True
+        logger.info(f"已加载记录索引: 共 {len(self.sizes)} 条记录")
+
+    def rebuild(self):
+        """扫描数据目录, 从记录文件重新生成索引文件, 返回记录条数
+
+        类型和时间戳取自文件名, 用户名取自记录内容中的 username 字段, 内容无法解析时才使用文件名中的用户名。
+        """
+        found = {}
+        for filename, path in self._iter_files():
+            if filename.endswith(BUNDLE_INDEX_SUFFIX):
+                day_dir = path[:-len(BUNDLE_INDEX_SUFFIX)]
+                for name, line in self._iter_bundle(day_dir):
+                    found[name] = self._rebuild_entry(name, line, len(line))
+                continue
+            parsed = parse_record_filename(filename)
+            if parsed is None:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except OSError as e:
+                logger.warning(f"无法读取记录文件 {filename}: {str(e)}")
+                continue
+            # 迁移或合并中途可能有同名文件, 内容相同, 保留任意一个即可
+            found[filename] = self._rebuild_entry(filename, body, len(body))
+        entries = sorted(found.values(), key=lambda entry: (entry["timestamp"], entry["filename"]))
+        temp_file = self.index_path + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json_codec.dumps(entry, pretty=False) + "\n")
+        with self.lock:
+            if self.index_file is not None:
+                self.index_file.close()
+                self.index_file = None
+            os.replace(temp_file, self.index_path)
+        if self.loaded:
+            self._replace(entries)
+            with self.lock:
+                self.index_file = open(self.index_path, 'a', encoding='utf-8')
+        logger.info(f"已重建记录索引: 共 {len(entries)} 条记录")
+        return len(entries)
+
+    @staticmethod
+    def _rebuild_entry(filename, body, size):
+        record_type, name_part, timestamp = parse_record_filename(filename)
+        username = username_from_filename_part(name_part)
+        try:
+            username = json_codec.loads(body).get('username', 'unknown')
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"无法解析记录 {filename}, 使用文件名中的用户名: {str(e)}")
+        return {"filename": filename, "type": record_type, "username": str(username),
+                "timestamp": timestamp, "size": size}
+
+    def _iter_files(self):
+        """依次列出平铺在数据目录下和分片目录中的所有文件, 返回 (文件名, 路径)"""
+        with os.scandir(self.directory) as scan:
+            for item in scan:
+                if item.is_file():
+                    yield item.name, item.path
+        for record_type in RECORD_TYPES:
+            for root, _, files in os.walk(os.path.join(self.directory, record_type)):
+                for filename in files:
+                    yield filename, os.path.join(root, filename)
+
+    def migrate(self):
+        """把平铺在数据目录下的记录文件和最新数据文件移动到分片目录, 返回移动的文件数
+
+        可以在服务器运行时执行, 也可以中断后重新执行。分片目录中已有同名的最新数据文件时,
+        说明服务器已经写入了更新的数据, 直接删除平铺的旧文件。
+        """
+        moved = 0
+        with os.scandir(self.directory) as scan:
+            names = [item.name for item in scan if item.is_file()]
+        for filename in names:
+            relative = record_path(filename)
+            if relative is None:
+                continue
+            source = os.path.join(self.directory, filename)
+            target = os.path.join(self.directory, relative)
+            self._make_dirs(os.path.dirname(target))
+            if filename.endswith(LATEST_SUFFIX) and os.path.exists(target):
+                os.remove(source)
+            else:
+                os.replace(source, target)
+            moved += 1
+            if moved % 10000 == 0:
+                logger.info(f"已移动 {moved} 个文件")
+        logger.info(f"迁移完成: 共移动 {moved} 个文件")
+        return moved
+
+    def compact(self, before=None):
+        """把 before 日期(YYYY-MM-DD, 默认今天)之前的每个日期目录合并为压缩包, 返回合并的记录文件数
+
+        服务器只向当天的日期目录写入, 因此可以在服务器运行时执行; 中断后重新执行会把已有的压缩包和剩下的文件重新合并。
+        """
+        before = before or datetime.date.today().isoformat()
+        compacted = 0
+        for day_dir in self._iter_day_dirs():
+            if os.path.basename(day_dir) < before:
+                compacted += self._compact_day(day_dir)
+        logger.info(f"合并完成: 共合并 {compacted} 个记录文件")
+        return compacted
+
+    def _iter_day_dirs(self):
+        """列出 类型/哈希前缀/用户名/日期 形式的所有日期目录"""
+        for record_type in RECORD_TYPES:
+            type_dir = os.path.join(self.directory, record_type)
+            if not os.path.isdir(type_dir):
+                continue
+            for prefix in os.scandir(type_dir):
+                if not prefix.is_dir():
+                    continue
+                for user in os.scandir(prefix.path):
+                    if not user.is_dir():
+                        continue
+                    for day in os.scandir(user.path):
+                        if day.is_dir():
+                            yield day.path
+
+    def _compact_day(self, day_dir):
+        """把一个日期目录中的记录文件写成压缩包和偏移索引, 再删除记录文件和目录
+
+        每条记录是压缩包中的一行紧凑 JSON, 若干行组成一个独立的 gzip 块, 整个文件仍然可以直接用 zcat 读取。
+        索引记录每个块的偏移和长度以及每条记录所在的块和行号, 读取一条记录只需要解压一个块。
+        """
+        lines = dict(self._iter_bundle(day_dir))
+        names = []
+        for name in sorted(os.listdir(day_dir)):
+            if parse_record_filename(name) is None:
+                continue
+            try:
+                with open(os.path.join(day_dir, name), 'rb') as f:
+                    # 早期的记录文件是缩进格式, 重新编码为单行
+                    lines[name] = json_codec.dumpb(json_codec.load(f), pretty=False)
+            except ValueError as e:
+                logger.warning(f"无法解析记录文件 {name}, 保留在原处: {str(e)}")
+                continue
+            names.append(name)
+        if not lines:
+            return 0
+
+        blocks = []
+        records = {}
+        block_lines = []
+        block_size = 0
+        with open(day_dir + BUNDLE_SUFFIX + ".tmp", 'wb') as f:
+            def write_block():
+                data = gzip.compress(b"\n".join(block_lines) + b"\n")
+                blocks.append([f.tell(), len(data)])
+                f.write(data)
+            for name in sorted(lines):
+                if block_lines and block_size + len(lines[name]) > BUNDLE_BLOCK_SIZE:
+                    write_block()
+                    block_lines = []
+                    block_size = 0
+                records[name] = [len(blocks), len(block_lines)]
+                block_lines.append(lines[name])
+                block_size += len(lines[name]) + 1
+            write_block()
+        with open(day_dir + BUNDLE_INDEX_SUFFIX + ".tmp", 'w', encoding='utf-8') as f:
+            json_codec.dump({"blocks": blocks, "records": records}, f, pretty=False)
+        # 先替换压缩包再替换索引, 两者之间的读取仍然可以从未删除的记录文件得到
+        os.replace(day_dir + BUNDLE_SUFFIX + ".tmp", day_dir + BUNDLE_SUFFIX)
+        os.replace(day_dir + BUNDLE_INDEX_SUFFIX + ".tmp", day_dir + BUNDLE_INDEX_SUFFIX)
+        for name in names:
+            os.remove(os.path.join(day_dir, name))
+        try:
+            os.rmdir(day_dir)
+        except OSError:
+            pass
+        return len(names)
+
+    def _iter_bundle(self, day_dir):
+        """按顺序列出一个日期目录的压缩包中的所有记录, 返回 (文件名, 记录内容)"""
+        index = self._bundle_index(day_dir)
+        if index is None:
+            return
+        names = {(block, line): name for name, (block, line) in index["records"].items()}
+        with open(day_dir + BUNDLE_SUFFIX, 'rb') as f:
+            for block, (offset, length) in enumerate(index["blocks"]):
+                f.seek(offset)
+                for line, body in enumerate(gzip.decompress(f.read(length)).split(b"\n")):
+                    if (block, line) in names:
+                        yield names[(block, line)], body
+
+    def _bundle_index(self, day_dir):
+        """读取压缩包索引, 按索引文件的修改时间缓存, 没有压缩包时返回 None"""
+        try:
+            mtime = os.stat(day_dir + BUNDLE_INDEX_SUFFIX).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self.bundle_indexes.get(day_dir)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(day_dir + BUNDLE_INDEX_SUFFIX, 'rb') as f:
+            index = json_codec.load(f)
+        with self.lock:
+            if len(self.bundle_indexes) >= BUNDLE_INDEX_CACHE_SIZE:
+                self.bundle_indexes.pop(next(iter(self.bundle_indexes)))
+            self.bundle_indexes[day_dir] = (mtime, index)
+        return index
+
+    def read(self, filename):
+        """读取记录文件或最新数据文件的内容, 依次查找分片目录、平铺目录和压缩包, 找不到时返回 None"""
+        path = self.locate(filename)
+        if path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    return json_codec.load(f)
+            except FileNotFoundError:
+                # 文件刚被合并进压缩包
+                pass
+        if parse_record_filename(filename) is None or os.path.basename(filename) != filename:
+            return None
+        day_dir = os.path.dirname(os.path.join(self.directory, record_path(filename)))
+        index = self._bundle_index(day_dir)
+        if index is None or filename not in index["records"]:
+            return None
+        block, line = index["records"][filename]
+        offset, length = index["blocks"][block]
+        with open(day_dir + BUNDLE_SUFFIX, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return json_codec.loads(gzip.decompress(data).split(b"\n")[line])
+
+    def locate(self, filename):
+        """按文件名找到记录文件或最新数据文件的路径, 先查分片目录再查平铺目录, 找不到时返回 None"""
+        relative = record_path(filename) if os.path.basename(filename) == filename else None
+        if relative is None:
+            return None
+        for path in (os.path.join(self.directory, relative), os.path.join(self.directory, filename)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _make_dirs(self, path):
+        if path not in self.made_dirs:
+            os.makedirs(path, exist_ok=True)
+            self.made_dirs.add(path)
+
+    def close(self):
+        with self.lock:
+            if self.index_file is not None:
+                self.index_file.close()
+                self.index_file = None
+            self.loaded = False
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    @staticmethod
+    def _list_keys(record_type, username):
+        return ((None, None), (record_type, None), (None, username), (record_type, username))
+
+    def _replace(self, entries):
+        sizes = {}
+        lists = {}
+        for entry in entries:
+            sizes[entry["filename"]] = entry["size"]
+            key = (entry["timestamp"], entry["filename"], entry["type"], entry["username"])
+            for list_key in self._list_keys(entry["type"], entry["username"]):
+                lists.setdefault(list_key, []).append(key)
+        for keys in lists.values():
+            keys.sort()
+        with self.lock:
+            self.sizes = sizes
+            self.lists = lists
+
+    def write(self, record_type, data):
+        """保存一条记录并更新最新数据文件, 返回历史记录文件名"""
+        self.ensure_loaded()
+        username = str(data.get('username', 'unknown'))
+        timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+        filename = record_filename(record_type, username, timestamp)
+        body = json_codec.dumpb(data)
+        for name in (filename, latest_filename(record_type, username)):
+            path = os.path.join(self.directory, record_path(name))
+            self._make_dirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(body)
+        self._add({"filename": filename, "type": record_type, "username": username,
+                   "timestamp": timestamp, "size": len(body)})
+        return filename
+
+    def write_batch(self, items):
+        """写入批量接口提交的多条记录, 每条记录带有 type 字段, 返回与输入一一对应的结果"""
+        results = []
+        for item in items:
+            if not isinstance(item, dict) or not item:
+                results.append({"status": 0, "message": "No data provided"})
+                continue
+            record_type = item.get("type")
+            if record_type not in RECORD_TYPES:
+                results.append({"status": 0, "message": f"Unsupported record type: {record_type}"})
+                continue
+            # 文件内容与逐条接口提交的数据相同, 不包含 type 字段
+            data = {key: value for key, value in item.items() if key != "type"}
+            filename = self.write(record_type, data)
+            results.append({"status": 1, "type": record_type, "username": data.get('username', 'unknown'),
+                            "filename": filename})
+        return results
+
+    def _add(self, entry):
+        filename = entry["filename"]
+        key = (entry["timestamp"], filename, entry["type"], entry["username"])
+        with self.lock:
+            self.index_file.write(json_codec.dumps(entry, pretty=False) + "\n")
+            self.index_file.flush()
+            # 同一秒内的重复写入覆盖同一个文件, 只更新大小
+            if filename in self.sizes:
+                self.sizes[filename] = entry["size"]
+                return
+            self.sizes[filename] = entry["size"]
+            for list_key in self._list_keys(entry["type"], entry["username"]):
+                keys = self.lists.setdefault(list_key, [])
+                # 记录基本按时间顺序写入, 绝大多数情况下直接追加到末尾
+                if not keys or key >= keys[-1]:
+                    keys.append(key)
+                else:
+                    insort(keys, key)
+
+    def list(self, record_type=None, username=None, offset=0, limit=None, newest_first=True):
+        """按时间顺序分页列出记录, 返回 (符合条件的总数, 本页记录)"""
+        self.ensure_loaded()
+        with self.lock:
+            keys = self.lists.get((record_type, username), [])
+            total = len(keys)
+            if newest_first:
+                end = max(total - offset, 0)
+                page = keys[max(end - limit, 0) if limit is not None else 0:end][::-1]
+            else:
+                page = keys[offset:offset + limit if limit is not None else None]
+            return total, [self._describe(key) for key in page]
+
+    def keys_after(self, last=None):
+        """按时间顺序返回排在 last 之后的所有记录的 (时间戳, 文件名, 类型, 用户名), last 为 None 时返回全部记录"""
+        self.ensure_loaded()
+        with self.lock:
+            keys = self.lists.get((None, None), [])
+            return keys[bisect_right(keys, tuple(last)):] if last is not None else list(keys)
+
+    def _describe(self, key):
+        timestamp, filename, record_type, username = key
+        return {
+            "filename": filename,
+            "type": record_type,
+            "username": username,
+            "size": self.sizes[filename],
+            "created": timestamp[:10] + " " + timestamp[11:].replace('-', ':'),
+        }
+
+    def stats(self):
+        """从内存索引的计数得到 /api/stats 的统计信息"""
+        self.ensure_loaded()
+        with self.lock:
+            users = [username for record_type, username in self.lists if record_type is None and username is not None]
+            counts = {record_type: len(self.lists.get((record_type, None), ())) for record_type in RECORD_TYPES}
+        return {
+            "total_users": len(users),
+            "users": users,
+            "status_records": counts["status"],
+            "skill_records": counts["skill"],
+            "total_records": sum(counts.values())
+        }
+
+    def type_counts(self):
+        """按类型返回 (有记录的用户数, 记录数), 用于 /metrics"""
+        self.ensure_loaded()
+        with self.lock:
+            users = dict.fromkeys(RECORD_TYPES, 0)
+            for record_type, username in self.lists:
+                if record_type is not None and username is not None:
+                    users[record_type] += 1
+            return {record_type: (users[record_type], len(self.lists.get((record_type, None), ())))
+                    for record_type in RECORD_TYPES}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="维护每条记录一个文件的数据目录")
+    parser.add_argument('--data-dir', default="civitas_data", help="数据目录, 默认 civitas_data")
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help=f"从记录文件重新生成 {INDEX_FILE}, 需在服务器停止时运行")
+    parser.add_argument('--migrate', action='store_true',
+                        help="把平铺在数据目录下的文件移动到 类型/哈希前缀/用户名/日期/ 分片目录, 可以在服务器运行时执行")
+    parser.add_argument('--compact', action='store_true',
+                        help="把已经结束的每个日期目录合并为一个压缩包和偏移索引, 可以在服务器运行时执行")
+    parser.add_argument('--before', help="与 --compact 一起使用, 只合并该日期(YYYY-MM-DD)之前的目录, 默认今天")
+    args = parser.parse_args()
+    if not args.rebuild_index and not args.migrate and not args.compact:
+        parser.print_help()
+    records = RecordFiles(args.data_dir)
+    if args.migrate:
+        records.migrate()
+    if args.compact:
+        records.compact(args.before)
+    if args.rebuild_index:
+        records.rebuild()
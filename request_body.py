@@ -0,0 +1,35 @@
+import zlib
+
+MAX_REQUEST_BODY_SIZE = 64 * 1024 * 1024  # 解压后的请求体最大字节数
+
+class RequestBodyError(Exception):
+    """请求体无法解码, status_code 为应返回的状态码"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+# 解压 gzip 编码的请求体, 超过大小上限时抛出 ValueError
+def decompress_request_body(body, limit=MAX_REQUEST_BODY_SIZE):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(body, limit)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Request body too large")
+    if not decompressor.eof:
+        raise zlib.error("Truncated gzip body")
+    return data
+
+def decode_request_body(body, content_encoding=None):
+    """按 Content-Encoding 解码请求体, 支持 identity 和 gzip, 无法解码时抛出 RequestBodyError"""
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    if content_encoding == 'identity':
+        return body
+    if content_encoding != 'gzip':
+        raise RequestBodyError(415, f"Unsupported Content-Encoding: {content_encoding}")
+    try:
+        return decompress_request_body(body)
+    except ValueError:
+        raise RequestBodyError(413, "Request body too large")
+    except zlib.error:
+        raise RequestBodyError(400, "Invalid gzip body")
@@ -0,0 +1,121 @@
+import queue
+import random
+import logging
+import logging.handlers
+
+# 日志队列的最大长度, 写满时丢弃低于 ERROR 级别的日志而不阻塞请求线程
+LOG_QUEUE_SIZE = 10000
+
+access_logger = logging.getLogger("civitas.access")
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录放入队列, 由后台线程格式化并写出
+
+    队列写满时丢弃 ERROR 以下级别的日志并计数, ERROR 及以上级别的日志等待队列有空位, 保证不会丢失。
+    日志消息在后台线程中才格式化, 因此传给日志的参数必须是之后不会再被修改的值。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 不在调用线程中格式化消息, 由 QueueListener 的处理器格式化
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.ERROR:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class QueueLogging:
+    """把根日志记录器的处理器移到后台线程, 请求线程只负责把日志记录放入队列"""
+
+    def __init__(self, queue_size=LOG_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.handler = None
+        self.listener = None
+        self.handlers = []
+
+    def start(self):
+        root = logging.getLogger()
+        self.handlers = list(root.handlers)
+        self.handler = NonBlockingQueueHandler(queue.Queue(self.queue_size))
+        self.listener = logging.handlers.QueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+        for handler in self.handlers:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        self.listener.start()
+
+    def stop(self):
+        """写出队列中剩余的日志并恢复原来的处理器"""
+        if self.listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            root.addHandler(handler)
+        if self.handler.dropped:
+            logging.getLogger(__name__).warning(f"日志队列已满, 共丢弃 {self.handler.dropped} 条日志")
+        self.listener = None
+
+class AccessLine:
+    """一行访问日志, 在写出时才转换为 key=value 文本"""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join(f"{key}={_quote(value)}" for key, value in self.fields)
+
+def _quote(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "=\\'):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
+class AccessLog:
+    """按路由采样的访问日志
+
+    sample_rates 把路由映射到记录的比例(0 到 1), 未列出的路由按 default_rate 记录。
+    状态码为 4xx 的请求总是以 WARNING 级别记录, 5xx 总是以 ERROR 级别记录, 不受采样影响。
+    """
+
+    def __init__(self, sample_rates=None, default_rate=1.0, logger=access_logger):
+        self.sample_rates = dict(sample_rates or {})
+        self.default_rate = default_rate
+        self.logger = logger
+
+    def log(self, method, route, path, status, seconds, bytes_in, bytes_out, client):
+        if status >= 500:
+            level = logging.ERROR
+        elif status >= 400:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+            rate = self.sample_rates.get(route, self.default_rate)
+            if rate < 1 and random.random() >= rate:
+                return
+        if not self.logger.isEnabledFor(level):
+            return
+        self.logger.log(level, "%s", AccessLine((
+            ("method", method), ("route", route), ("path", path), ("status", status),
+            ("ms", round(seconds * 1000, 2)), ("in", bytes_in), ("out", bytes_out), ("client", client),
+        )))
+
+def parse_sample_rate(item):
+    """解析命令行中的 路由=比例, 返回 (路由, 比例)"""
+    route, sep, rate = item.rpartition('=')
+    if not sep or not route:
+        raise ValueError(f"采样设置应为 路由=比例: {item}")
+    rate = float(rate)
+    if not 0 <= rate <= 1:
+        raise ValueError(f"采样比例应在 0 到 1 之间: {item}")
+    return route, rate
@@ -1,4 +1,4 @@
-import json
+import json_codec
 import pandas as pd
 
 def main():
@@ -6,7 +6,7 @@ def main():
     # 读取测试结果
     try:
         with open('taste_happiness_results.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
+            data = json_codec.load(f)
     except FileNotFoundError:
         print("未找到测试结果文件")
         return
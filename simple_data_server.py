@@ -1,9 +1,12 @@
 import http.server
-import json
+import json_codec
 import os
-import datetime
 import logging
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, unquote
+from metrics import Registry, HttpMetrics, InstrumentedHandlerMixin, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from request_log import AccessLog, QueueLogging
+from record_files import RecordFiles, RECORD_TYPES
+from request_body import RequestBodyError, decode_request_body
 
 # 配置日志
 logging.basicConfig(
@@ -18,7 +21,28 @@ if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
     logger.info(f"创建数据目录: {DATA_DIR}")
 
-class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
+# /metrics 中按路由统计的路径, 以 / 结尾的按前缀匹配, 其余路径归为 other
+METRIC_ROUTES = ('/', '/api/list_records', '/api/get_record/', '/api/stats', '/metrics',
+                 '/api/record_status', '/api/record_skill', '/api/record_batch')
+LIST_RECORDS_DEFAULT_LIMIT = 100  # /api/list_records 默认返回的记录条数
+LIST_RECORDS_MAX_LIMIT = 10000  # /api/list_records 单次最多返回的记录条数
+# 访问日志中成功请求的采样比例, 未列出的路由全部记录; 出错的请求总是记录
+ACCESS_LOG_SAMPLE_RATES = {
+    '/api/record_status': 0.1,
+    '/api/record_skill': 0.1,
+    '/api/record_batch': 0.1,
+}
+
+# 数据目录及其内存索引
+RECORDS = RecordFiles(DATA_DIR)
+
+METRICS = Registry()
+METRICS.gauge("civitas_store_users", "每种类型有最新数据的用户数",
+              lambda: {(record_type,): users for record_type, (users, _) in RECORDS.type_counts().items()}, ("type",))
+METRICS.gauge("civitas_history_records", "每种类型的历史记录文件数",
+              lambda: {(record_type,): records for record_type, (_, records) in RECORDS.type_counts().items()}, ("type",))
+
+class CivitasDataHandler(InstrumentedHandlerMixin, http.server.BaseHTTPRequestHandler):
     def _set_headers(self, content_type='application/json', status_code=200):
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
@@ -39,38 +63,50 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
         if path == '/':
             self._serve_home_page()
         elif path == '/api/list_records':
-            self._list_records()
+            self._list_records(parse_qs(parsed_url.query))
         elif path.startswith('/api/get_record/'):
-            filename = path.split('/api/get_record/')[1]
+            filename = unquote(path.split('/api/get_record/')[1])
             self._get_record(filename)
         elif path == '/api/stats':
             self._get_stats()
+        elif path == '/metrics':
+            self._set_headers(content_type=METRICS_CONTENT_TYPE)
+            self.wfile.write(METRICS.render())
         else:
             self._set_headers(status_code=404)
-            self.wfile.write(json.dumps({"status": 0, "message": "Not found"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": "Not found"}))
     
     def do_POST(self):
         """处理 POST 请求"""
-        content_length = int(self.headers['Content-Length'])
+        content_length = int(self.headers.get('Content-Length', 0))
         post_data = self.rfile.read(content_length)
         
         try:
-            data = json.loads(post_data.decode('utf-8'))
+            post_data = decode_request_body(post_data, self.headers.get('Content-Encoding'))
+        except RequestBodyError as e:
+            self._set_headers(status_code=e.status_code)
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": e.message}))
+            return
+        
+        try:
+            data = json_codec.loads(post_data)
             
             if self.path == '/api/record_status':
                 self._record_status(data)
             elif self.path == '/api/record_skill':
                 self._record_skill(data)
+            elif self.path == '/api/record_batch':
+                self._record_batch(data)
             else:
                 self._set_headers(status_code=404)
-                self.wfile.write(json.dumps({"status": 0, "message": "Not found"}).encode())
-        except json.JSONDecodeError:
+                self.wfile.write(json_codec.dumpb({"status": 0, "message": "Not found"}))
+        except json_codec.JSONDecodeError:
             self._set_headers(status_code=400)
-            self.wfile.write(json.dumps({"status": 0, "message": "Invalid JSON"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": "Invalid JSON"}))
         except Exception as e:
             logger.error(f"处理请求时发生错误: {str(e)}")
             self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Server error: {str(e)}"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Server error: {str(e)}"}))
     
     def _serve_home_page(self):
         """提供主页 HTML"""
@@ -103,8 +139,13 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
                 </div>
                 
                 <div class="endpoint">
-                    <p><span class="method">GET</span> /api/list_records</p>
-                    <p>列出所有记录的数据文件</p>
+                    <p><span class="method">POST</span> /api/record_batch</p>
+                    <p>批量记录多条数据, 支持 gzip 压缩的请求体</p>
+                </div>
+                
+                <div class="endpoint">
+                    <p><span class="method">GET</span> /api/list_records?type=&amp;username=&amp;offset=&amp;limit=&amp;order=</p>
+                    <p>分页列出记录的数据文件, 可按类型和用户筛选</p>
                 </div>
                 
                 <div class="endpoint">
@@ -127,150 +168,134 @@ class CivitasDataHandler(http.server.BaseHTTPRequestHandler):
         try:
             if not data:
                 self._set_headers(status_code=400)
-                self.wfile.write(json.dumps({"status": 0, "message": "No data provided"}).encode())
+                self.wfile.write(json_codec.dumpb({"status": 0, "message": "No data provided"}))
                 return
             
-            # 确保有基本信息
-            username = data.get('username', 'unknown')
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            
-            # 记录状态信息
-            status_file = os.path.join(DATA_DIR, f"status_{username}_{timestamp}.json")
-            with open(status_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 记录状态信息并更新最新状态文件
+            status_file = RECORDS.write("status", data)
             
-            # 更新最新状态文件
-            latest_status_file = os.path.join(DATA_DIR, f"status_{username}_latest.json")
-            with open(latest_status_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"状态数据已记录: {status_file}")
+            logger.debug(f"状态数据已记录: {status_file}")
             self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "message": "Status data recorded successfully"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 1, "message": "Status data recorded successfully"}))
         
         except Exception as e:
             logger.error(f"记录状态数据时出错: {str(e)}")
             self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error recording status data: {str(e)}"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Error recording status data: {str(e)}"}))
     
     def _record_skill(self, data):
         """记录技能数据"""
         try:
             if not data:
                 self._set_headers(status_code=400)
-                self.wfile.write(json.dumps({"status": 0, "message": "No data provided"}).encode())
+                self.wfile.write(json_codec.dumpb({"status": 0, "message": "No data provided"}))
                 return
             
-            # 确保有基本信息
-            username = data.get('username', 'unknown')
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            
-            # 记录技能信息
-            skill_file = os.path.join(DATA_DIR, f"skill_{username}_{timestamp}.json")
-            with open(skill_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 记录技能信息并更新最新技能文件
+            skill_file = RECORDS.write("skill", data)
             
-            # 更新最新技能文件
-            latest_skill_file = os.path.join(DATA_DIR, f"skill_{username}_latest.json")
-            with open(latest_skill_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"技能数据已记录: {skill_file}")
+            logger.debug(f"技能数据已记录: {skill_file}")
             self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "message": "Skill data recorded successfully"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 1, "message": "Skill data recorded successfully"}))
         
         except Exception as e:
             logger.error(f"记录技能数据时出错: {str(e)}")
             self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error recording skill data: {str(e)}"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Error recording skill data: {str(e)}"}))
+    
+    def _record_batch(self, data):
+        """批量记录油猴脚本一次提交的多条数据, 请求体可以是 gzip 压缩的"""
+        try:
+            items = data.get("records") if isinstance(data, dict) else data
+            if not isinstance(items, list) or not items:
+                self._set_headers(status_code=400)
+                self.wfile.write(json_codec.dumpb({"status": 0, "message": "No records provided"}))
+                return
+            
+            results = RECORDS.write_batch(items)
+            recorded = sum(1 for result in results if result["status"] == 1)
+            logger.debug(f"批量数据已记录: {recorded}/{len(results)}")
+            self._set_headers()
+            self.wfile.write(json_codec.dumpb({
+                "status": 1 if recorded == len(results) else 0,
+                "message": f"{recorded}/{len(results)} records recorded",
+                "results": results
+            }))
+        
+        except Exception as e:
+            logger.error(f"批量记录数据时出错: {str(e)}")
+            self._set_headers(status_code=500)
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Error recording batch: {str(e)}"}))
     
-    def _list_records(self):
-        """列出所有记录"""
+    def _list_records(self, query):
+        """分页列出记录, 支持 type= 和 username= 筛选, 默认最新的在前, order=asc 时最早的在前"""
         try:
-            records = []
-            for filename in os.listdir(DATA_DIR):
-                if filename.endswith(".json") and not filename.endswith("_latest.json"):
-                    file_path = os.path.join(DATA_DIR, filename)
-                    stat = os.stat(file_path)
-                    records.append({
-                        "filename": filename,
-                        "size": stat.st_size,
-                        "created": datetime.datetime.fromtimestamp(stat.st_ctime).strftime("%Y-%m-%d %H:%M:%S")
-                    })
+            record_type = query.get('type', [None])[0]
+            username = query.get('username', [None])[0]
+            try:
+                offset = int(query.get('offset', [0])[0])
+                limit = int(query.get('limit', [LIST_RECORDS_DEFAULT_LIMIT])[0])
+            except ValueError:
+                offset = limit = -1
+            if offset < 0 or limit < 0:
+                self._set_headers(status_code=400)
+                self.wfile.write(json_codec.dumpb({"status": 0, "message": "Invalid offset or limit"}))
+                return
+            if record_type is not None and record_type not in RECORD_TYPES:
+                self._set_headers(status_code=400)
+                self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Unknown record type: {record_type}"}))
+                return
             
-            # 按时间排序，最新的在前
-            records.sort(key=lambda x: x["created"], reverse=True)
+            total, records = RECORDS.list(record_type=record_type, username=username, offset=offset,
+                                          limit=min(limit, LIST_RECORDS_MAX_LIMIT),
+                                          newest_first=query.get('order', ['desc'])[0] != 'asc')
             
             self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "data": records}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 1, "total": total, "offset": offset, "data": records}))
         
         except Exception as e:
             logger.error(f"列出记录时出错: {str(e)}")
             self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error listing records: {str(e)}"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Error listing records: {str(e)}"}))
     
     def _get_record(self, filename):
         """获取特定记录的内容"""
         try:
-            file_path = os.path.join(DATA_DIR, filename)
-            if not os.path.exists(file_path):
+            data = RECORDS.read(filename)
+            if data is None:
                 self._set_headers(status_code=404)
-                self.wfile.write(json.dumps({"status": 0, "message": "Record not found"}).encode())
+                self.wfile.write(json_codec.dumpb({"status": 0, "message": "Record not found"}))
                 return
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
             self._set_headers()
-            self.wfile.write(json.dumps({"status": 1, "data": data}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 1, "data": data}))
         
         except Exception as e:
             logger.error(f"获取记录时出错: {str(e)}")
             self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error getting record: {str(e)}"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Error getting record: {str(e)}"}))
     
     def _get_stats(self):
         """获取统计信息"""
         try:
-            # 找出所有用户
-            users = set()
-            status_records = 0
-            skill_records = 0
-            
-            for filename in os.listdir(DATA_DIR):
-                if not filename.endswith("_latest.json"):
-                    parts = filename.split('_')
-                    if len(parts) >= 2:
-                        record_type = parts[0]
-                        username = parts[1]
-                        users.add(username)
-                        
-                        if record_type == "status":
-                            status_records += 1
-                        elif record_type == "skill":
-                            skill_records += 1
-            
             self._set_headers()
-            self.wfile.write(json.dumps({
-                "status": 1, 
-                "data": {
-                    "total_users": len(users),
-                    "users": list(users),
-                    "status_records": status_records,
-                    "skill_records": skill_records,
-                    "total_records": status_records + skill_records
-                }
-            }).encode())
+            self.wfile.write(json_codec.dumpb({"status": 1, "data": RECORDS.stats()}))
         
         except Exception as e:
             logger.error(f"获取统计信息时出错: {str(e)}")
             self._set_headers(status_code=500)
-            self.wfile.write(json.dumps({"status": 0, "message": f"Error getting stats: {str(e)}"}).encode())
+            self.wfile.write(json_codec.dumpb({"status": 0, "message": f"Error getting stats: {str(e)}"}))
 
 def run_server(host='0.0.0.0', port=5000):
     """运行服务器"""
+    # 日志由后台线程写出, 请求线程只把日志记录放入队列
+    queue_logging = QueueLogging()
+    queue_logging.start()
+    RECORDS.load()
     server_address = (host, port)
     httpd = http.server.HTTPServer(server_address, CivitasDataHandler)
+    httpd.metrics = HttpMetrics(METRICS, METRIC_ROUTES)
+    httpd.access_log = AccessLog(ACCESS_LOG_SAMPLE_RATES)
     logger.info(f"Civitas 数据服务器启动在 http://{host}:{port}")
     logger.info(f"数据将被保存到 {os.path.abspath(DATA_DIR)} 目录")
     try:
@@ -279,6 +304,8 @@ def run_server(host='0.0.0.0', port=5000):
         logger.info("服务器已停止")
     finally:
         httpd.server_close()
+        RECORDS.close()
+        queue_logging.stop()
 
 if __name__ == '__main__':
     run_server()
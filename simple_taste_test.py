@@ -1,5 +1,5 @@
 from recipe_analyzer import RecipeAnalyzer
-import json
+import json_codec
 import os
 
 def main():
@@ -136,7 +136,7 @@ def main():
     
     # 保存结果
     with open('taste_happiness_results.json', 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+        json_codec.dump(results, f)
     
     print("\n详细结果已保存到 taste_happiness_results.json")
 
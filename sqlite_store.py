@@ -0,0 +1,276 @@
+import os
+import sqlite3
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+
+import json_codec
+from events import describe_changes
+from history_store import UNTIL_SUFFIX
+from ingest_stats import IngestStats
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    type TEXT NOT NULL,
+    username TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (type, username)
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    username TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_username_type_timestamp ON history (username, type, timestamp);
+CREATE INDEX IF NOT EXISTS history_type_timestamp ON history (type, timestamp);
+CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# 写入路径使用固定的 SQL 文本, sqlite3 模块会缓存并复用预编译语句
+INSERT_HISTORY = "INSERT INTO history (type, username, timestamp, data) VALUES (?, ?, ?, ?)"
+UPSERT_RECORD = """INSERT INTO records (type, username, timestamp, data) VALUES (?, ?, ?, ?)
+    ON CONFLICT (type, username) DO UPDATE SET timestamp = excluded.timestamp, data = excluded.data"""
+UPSERT_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+
+READER_POOL_SIZE = 8  # 读取连接池的最大连接数, 并发读取超过时等待空闲连接
+
+def encode_data(data):
+    return json_codec.dumps(data, pretty=False)
+
+class SqliteStore:
+    """SQLite 存储
+
+    当前数据、历史记录和更新时间保存在 WAL 模式的 SQLite 数据库中, 每批写入是一个事务,
+    提交即落盘, 不再需要重写整个整合数据文件。历史记录在 (username, type, timestamp) 上建有索引,
+    所有读取接口都直接由 SQL 查询得到。
+    写入使用一个共享连接并由锁串行化, 读取从最多 pool_size 个连接的连接池中借用连接, 与写入互不阻塞,
+    打开的文件数不随处理请求的线程数增长。
+    sections 把整合数据中的字段名映射到记录类型, 例如 {"skills": "skill"}。
+    """
+
+    def __init__(self, path, sections, pool_size=READER_POOL_SIZE):
+        self.path = path
+        self.sections = sections
+        self.lock = threading.Lock()
+        self._writer = None
+        self.pool_size = pool_size
+        self._idle_readers = []
+        self._reader_count = 0
+        # 读取连接可能在持有写锁时借用, 使用单独的锁
+        self._readers_available = threading.Condition(threading.Lock())
+        # 每次写入递增的版本号, 与本次启动的随机标识一起作为 /api/data 的 ETag
+        self.version = 0
+        self.epoch = os.urandom(4).hex()
+        self.events = None  # 有订阅者时在锁内向其发布变化事件
+        self.ingest_stats = IngestStats(sections.values())
+        self.history_counts = {record_type: 0 for record_type in sections.values()}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    @contextmanager
+    def _reader(self):
+        """从连接池借用一个读取连接, 连接数已达上限时等待其他读取归还"""
+        with self._readers_available:
+            while not self._idle_readers and self._reader_count >= self.pool_size:
+                self._readers_available.wait()
+            if self._idle_readers:
+                conn = self._idle_readers.pop()
+            else:
+                conn = None
+                self._reader_count += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._readers_available:
+                    self._reader_count -= 1
+                    self._readers_available.notify()
+                raise
+        try:
+            yield conn
+        finally:
+            with self._readers_available:
+                self._idle_readers.append(conn)
+                self._readers_available.notify()
+
+    def open(self):
+        self._writer = self._connect()
+        with self._writer:
+            self._writer.executescript(SCHEMA)
+        # 统计信息只在启动时查询一次, 之后在写入时增量维护
+        for record_type, username, timestamp in self._writer.execute("SELECT type, username, timestamp FROM records"):
+            self.ingest_stats.load(record_type, username, timestamp)
+        for record_type, count in self._writer.execute("SELECT type, COUNT(*) FROM history GROUP BY type"):
+            self.history_counts[record_type] = count
+        logger.info(f"已打开 SQLite 数据库: {self.path} (历史记录 {sum(self.history_counts.values())} 条)")
+
+    def _previous(self, record_type, username):
+        row = self._writer.execute("SELECT data FROM records WHERE type = ? AND username = ?",
+                                   (record_type, username)).fetchone()
+        return json_codec.loads(row[0]) if row else None
+
+    def record_batch(self, records):
+        """在一个事务中写入多条记录"""
+        rows = [(record["type"], record["username"], record["timestamp"], encode_data(record["data"]))
+                for record in records]
+        with self.lock:
+            changes = describe_changes(records, self._previous) if self.events else None
+            with self._writer:
+                self._writer.executemany(INSERT_HISTORY, rows)
+                self._writer.executemany(UPSERT_RECORD, rows)
+                self._writer.execute(UPSERT_META, ("last_updated", records[-1].get("received") or datetime.datetime.now().isoformat()))
+            self.version += 1
+            self.ingest_stats.record(records)
+            for record in records:
+                self.history_counts[record["type"]] += 1
+            if changes:
+                self.events.publish(changes)
+
+    def import_state(self, state, last_updated):
+        """导入整合数据中每个用户的最新数据"""
+        rows = []
+        for section, entries in state.items():
+            for username, entry in entries.items():
+                rows.append((self.sections[section], username, entry["timestamp"], encode_data(entry["data"])))
+        with self.lock, self._writer:
+            self._writer.executemany(UPSERT_RECORD, rows)
+            self._writer.execute(UPSERT_META, ("last_updated", last_updated))
+            self.version += 1
+            for record_type, username, timestamp, _ in rows:
+                self.ingest_stats.load(record_type, username, timestamp)
+        return len(rows)
+
+    def import_history(self, entries):
+        """导入一批历史记录"""
+        rows = [(entry["type"], entry["username"], entry["timestamp"], encode_data(entry["data"])) for entry in entries]
+        with self.lock, self._writer:
+            self._writer.executemany(INSERT_HISTORY, rows)
+            self.version += 1
+            for row in rows:
+                self.history_counts[row[0]] += 1
+
+    def etag(self):
+        """当前数据版本对应的 ETag"""
+        return f'"{self.epoch}-{self.version}"'
+
+    def section(self, name, users=None):
+        """返回某一字段下所有用户的数据"""
+        sql = "SELECT username, timestamp, data FROM records WHERE type = ?"
+        params = [self.sections[name]]
+        if users is not None:
+            sql += f" AND username IN ({','.join('?' * len(users))})"
+            params.extend(users)
+        with self._reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return {username: {"timestamp": timestamp, "data": json_codec.loads(data)} for username, timestamp, data in rows}
+
+    def last_updated(self):
+        with self._reader() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'last_updated'").fetchone()
+        return row[0] if row else datetime.datetime.now().isoformat()
+
+    def export_data(self, fields, users=None, history_limit=1000, cursor=None):
+        """返回选定字段的数据, 历史记录从 cursor 开始向前分页, 返回 (数据, 下一页游标)"""
+        data = {}
+        for key in fields:
+            if key in self.sections:
+                data[key] = self.section(key, users)
+            elif key == "last_updated":
+                data[key] = self.last_updated()
+        next_cursor = None
+        if "history" in fields:
+            data["history"], next_cursor = self._page_history(users, cursor, history_limit)
+        return data, next_cursor
+
+    def _page_history(self, users, cursor, limit):
+        conditions = []
+        params = []
+        if users is not None:
+            conditions.append(f"username IN ({','.join('?' * len(users))})")
+            params.extend(users)
+        if cursor:
+            timestamp, row_id = cursor
+            conditions.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+            params.extend([timestamp, timestamp, row_id])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._reader() as conn:
+            rows = conn.execute(
+                f"SELECT id, type, username, timestamp, data FROM history {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        next_cursor = (rows[0][3], rows[0][0]) if more and rows else None
+        return [self._history_entry(row) for row in rows], next_cursor
+
+    @staticmethod
+    def _history_entry(row):
+        _, record_type, username, timestamp, data = row
+        return {"type": record_type, "username": username, "timestamp": timestamp, "data": json_codec.loads(data)}
+
+    def query_history(self, username=None, record_type=None, since=None, until=None, limit=None):
+        """按用户、类型和时间范围查询历史记录
+
+        返回 (命中总数, 记录列表)。记录按时间升序排列, 命中数超过 limit 时只返回最新的 limit 条。
+        """
+        conditions = []
+        params = []
+        if username is not None:
+            conditions.append("username = ?")
+            params.append(username)
+        if record_type is not None:
+            conditions.append("type = ?")
+            params.append(record_type)
+        if since:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            conditions.append("timestamp <= ?")
+            params.append(until + UNTIL_SUFFIX)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT id, type, username, timestamp, data FROM history {where} ORDER BY timestamp DESC, id DESC"
+        with self._reader() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM history {where}", params).fetchone()[0]
+            if limit is not None:
+                sql += " LIMIT ?"
+                params = params + [limit]
+            rows = conn.execute(sql, params).fetchall()
+        rows.reverse()
+        return total, [self._history_entry(row) for row in rows]
+
+    def iter_history(self):
+        """按时间顺序遍历全部历史记录, 遍历结束前一直占用一个读取连接"""
+        with self._reader() as conn:
+            for row in conn.execute("SELECT id, type, username, timestamp, data FROM history ORDER BY timestamp, id"):
+                yield self._history_entry(row)
+
+    def stats(self):
+        """返回写入时增量维护的统计信息"""
+        with self.lock:
+            return self.ingest_stats.summary(dict(self.history_counts), self.last_updated())
+
+    def close(self):
+        with self._readers_available:
+            for conn in self._idle_readers:
+                conn.close()
+            self._reader_count -= len(self._idle_readers)
+            self._idle_readers = []
+        with self.lock:
+            if self._writer:
+                self._writer.close()
+                self._writer = None
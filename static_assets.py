@@ -0,0 +1,97 @@
+import os
+import gzip
+import logging
+import threading
+from email.utils import formatdate
+
+logger = logging.getLogger(__name__)
+
+# 按扩展名确定内容类型
+CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.json': 'application/json',
+}
+
+class StaticAsset:
+    """一个静态文件在某次修改后的只读快照"""
+
+    def __init__(self, path, stat, content=None, gzipped=None):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.content = content  # 大文件不放入内存, 发送时直接从文件读取
+        self.gzipped = gzipped
+        self.content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], 'text/plain')
+        self.etag = f'"{self.mtime_ns:x}-{self.size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+    def matches(self, stat):
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+class StaticAssetCache:
+    """可视化页面静态文件的内存缓存
+
+    文件第一次被请求时读入内存并预先压缩, 之后只做一次 stat 检查修改时间,
+    文件变化时重新加载; 缓存中的对象不会被修改, 只会被整体替换, 因此读取不需要加锁。
+    超过 sendfile_min_size 的文件只缓存元数据, 发送时使用 sendfile 零拷贝。
+    sources 把请求路径映射到其他位置的源文件, 其余路径在 directory 下查找。
+    """
+
+    def __init__(self, directory, sources=None, gzip_min_size=1024, sendfile_min_size=256 * 1024):
+        self.directory = os.path.realpath(directory)
+        self.sources = sources or {}
+        self.gzip_min_size = gzip_min_size
+        self.sendfile_min_size = sendfile_min_size
+        self.assets = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, name):
+        """把请求路径转换为文件路径, 路径不在目录内时返回 None"""
+        if name in self.sources:
+            return self.sources[name]
+        path = os.path.realpath(os.path.join(self.directory, name))
+        if not path.startswith(self.directory + os.sep):
+            return None
+        return path
+
+    def get(self, name):
+        """返回静态文件的最新快照, 文件不存在时返回 None"""
+        path = self.resolve(name)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        asset = self.assets.get(path)
+        if asset is not None and asset.matches(stat):
+            return asset
+        return self._load(path, stat)
+
+    def _load(self, path, stat):
+        with self.lock:
+            asset = self.assets.get(path)
+            if asset is not None and asset.matches(stat):
+                return asset
+            if stat.st_size >= self.sendfile_min_size:
+                asset = StaticAsset(path, stat)
+            else:
+                while True:
+                    with open(path, 'rb') as f:
+                        content = f.read()
+                    # 读取期间文件被修改时重新读取, 避免缓存的内容与修改时间不一致
+                    after = os.stat(path)
+                    if after.st_mtime_ns == stat.st_mtime_ns and after.st_size == stat.st_size:
+                        break
+                    stat = after
+                gzipped = None
+                if len(content) >= self.gzip_min_size and CONTENT_TYPES.get(os.path.splitext(path)[1]):
+                    gzipped = gzip.compress(content, compresslevel=9)
+                asset = StaticAsset(path, stat, content=content, gzipped=gzipped)
+            self.assets[path] = asset
+            logger.info(f"已加载静态文件: {path} ({asset.size} 字节)")
+            return asset
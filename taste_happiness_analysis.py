@@ -1,5 +1,5 @@
 import os
-import json
+import json_codec
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import numpy as np
@@ -121,7 +121,7 @@ class TasteHappinessAnalyzer:
         timestamp = self.analyzer.get_timestamp()
         filename = f"{self.data_dir}/taste_happiness_{timestamp}.json"
         with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+            json_codec.dump(results, f)
         
         print(f"\n测试结果已保存到 {filename}")
         return results
@@ -141,7 +141,7 @@ class TasteHappinessAnalyzer:
             
             latest_file = os.path.join(self.data_dir, files[-1])
             with open(latest_file, 'r', encoding='utf-8') as f:
-                results = json.load(f)
+                results = json_codec.load(f)
         
         if not results:
             print("没有足够的测试数据进行分析")
@@ -213,7 +213,7 @@ class TasteHappinessAnalyzer:
             
             latest_file = os.path.join(self.data_dir, files[-1])
             with open(latest_file, 'r', encoding='utf-8') as f:
-                results = json.load(f)
+                results = json_codec.load(f)
         
         if not results:
             print("没有足够的测试数据进行分析")
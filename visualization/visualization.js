@@ -1,6 +1,9 @@
 // 全局变量
 let userData = {};
 let lastUpdatedTime = null;
+let dataETag = null;
+let pendingChanges = null;  // 完整数据请求进行中时暂存收到的变化事件
+let renderScheduled = false;
 
 // DOM元素
 const parametersTable = document.getElementById('parameters-table');
@@ -16,7 +19,7 @@ const historyRecordsElement = document.getElementById('history-records');
 
 // 初始化
 document.addEventListener('DOMContentLoaded', () => {
-    fetchData();
+    subscribeEvents();
     
     // 设置事件监听器
     refreshBtn.addEventListener('click', fetchData);
@@ -28,13 +31,21 @@ document.addEventListener('DOMContentLoaded', () => {
  */
 async function fetchData() {
     try {
-        const response = await fetch('/api/data');
+        // 页面只用到当前数据, 不拉取历史记录; 数据没有变化时服务器返回 304
+        const headers = dataETag ? { 'If-None-Match': dataETag } : {};
+        const response = await fetch('/api/data?fields=status,skills,userdetail', { headers });
+        if (response.status === 304) {
+            lastUpdatedTime = new Date();
+            updateLastUpdated();
+            return;
+        }
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         
         const data = await response.json();
         if (data.status === 1) {
+            dataETag = response.headers.get('ETag');
             userData = data.data;
             lastUpdatedTime = new Date();
             updateUI();
@@ -47,6 +58,101 @@ async function fetchData() {
     }
 }
 
+/**
+ * 订阅服务器推送的变化事件, 每次(重新)连接后同步一次完整数据
+ */
+function subscribeEvents() {
+    if (!window.EventSource) {
+        fetchData();
+        return;
+    }
+    const eventSource = new EventSource('/api/events');
+    eventSource.addEventListener('open', syncData);
+    // 服务器不提供事件流时(single 和 pool 引擎返回 503)连接直接关闭, 只获取一次完整数据
+    eventSource.addEventListener('error', () => {
+        if (eventSource.readyState === EventSource.CLOSED) {
+            fetchData();
+        }
+    });
+    eventSource.addEventListener('change', event => {
+        const changes = JSON.parse(event.data).changes;
+        if (pendingChanges !== null) {
+            pendingChanges.push(...changes);
+            return;
+        }
+        changes.forEach(applyChange);
+        scheduleRender();
+    });
+}
+
+/**
+ * 获取完整数据, 并重放请求期间收到的变化事件
+ */
+async function syncData() {
+    pendingChanges = [];
+    await fetchData();
+    const changes = pendingChanges;
+    pendingChanges = null;
+    if (changes.length > 0) {
+        changes.forEach(applyChange);
+        scheduleRender();
+    }
+}
+
+/**
+ * 把一条变化事件应用到 userData 上
+ */
+function applyChange(change) {
+    const section = change.type === 'skill' ? 'skills' : change.type;
+    if (!userData[section]) {
+        userData[section] = {};
+    }
+    const entry = userData[section][change.username];
+    if (change.data !== undefined || !entry) {
+        userData[section][change.username] = { timestamp: change.timestamp, data: change.data };
+        return;
+    }
+    entry.timestamp = change.timestamp;
+    entry.data = applyOps(entry.data, change.ops);
+}
+
+/**
+ * 应用字段差异: [路径, 新值] 设置字段, [路径] 删除字段
+ */
+function applyOps(data, ops) {
+    const root = { value: data };
+    ops.forEach(([path, ...value]) => {
+        const keys = ['value', ...path];
+        let parent = root;
+        for (let i = 0; i < keys.length - 1; i++) {
+            parent = parent[keys[i]];
+        }
+        const key = keys[keys.length - 1];
+        if (value.length > 0) {
+            parent[key] = value[0];
+        } else {
+            delete parent[key];
+        }
+    });
+    return root.value;
+}
+
+/**
+ * 合并同一帧内的多次更新, 只重新渲染一次表格
+ */
+function scheduleRender() {
+    if (renderScheduled) {
+        return;
+    }
+    renderScheduled = true;
+    requestAnimationFrame(() => {
+        renderScheduled = false;
+        lastUpdatedTime = new Date();
+        updateUI();
+        filterUsers();
+    });
+}
+
 /**
  * 获取统计数据
  */